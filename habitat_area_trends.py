@@ -22,10 +22,11 @@
 
 # imports
 import os
-import geopandas as gpd
 import pandas as pd
 import numpy as np
-import csv
+import scl_engine
+import scl_plan
+import scl_output
 
 
 # Set up
@@ -38,11 +39,12 @@ pivot_subdir = "pivot_tables\habitat_areas"
 datafile = "scl_states.geojson"
 # csv output file
 csv_file = 'habitat_area_trends.csv'
+# sheet name in xlsx output
+sheet_name = 'Habitat area trends'
 
-# the years to analyze are:
-years = ['2020-01-01','2019-01-01','2018-01-01','2017-01-01','2016-01-01','2015-01-01','2014-01-01','2013-01-01','2012-01-01','2011-01-01','2010-01-01','2009-01-01','2008-01-01','2007-01-01','2006-01-01','2005-01-01','2004-01-01','2003-01-01','2002-01-01','2001-01-01']
-# a single year for testing purposes
-#years = ['2020-01-01']
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+# a single year for testing purposes:  --years 2020-01-01
 # habitat types to analyze are:
 types = ['indigenous_range_area','str_hab_area','eff_pot_hab_area','occupied_eff_pot_hab_area']
 # variable names
@@ -51,35 +53,39 @@ habitat_names = ['Indigenous resident range', 'Structural habitat', 'Effective p
 habitat_area_names = {types[i]: habitat_names[i] for i in range(len(types))}
 
 
-# make an empty dictionary to hold areas by year
-df_hab_areas = {}
+# the range-wide total of each habitat type
+plans = {'totals': scl_plan.Plan(datafile).group_sum([], types)}
 
-# loop over years and calculate 
-for year in years:
+
+# loop over years and pick up the sum of each habitat type
+def build(dfs, years):
+
+    # make an empty dictionary to hold areas by year
+    df_hab_areas = {}
+
+    for year in years:
     
-    # create empty dictionary for this year
-    df_hab_areas[year] = {}
+        # create empty dictionary for this year
+        df_hab_areas[year] = {}
     
-    # load gejson files into df
-    df = gpd.read_file(os.path.join(scl_dir, year, datafile))
+        totals = dfs[(year, 'totals')]
 
-    # for each habitat type, just sum up the column
-    for type in types:
-        print ("Working on", year, type)
-        df_hab_areas[year][type] = df[type].sum()
+        # for each habitat type, the column sum
+        for type in types:
+            print ("Working on", year, type)
+            df_hab_areas[year][type] = totals[type].iloc[0]
 
-#print(df_hab_areas)
+    return df_hab_areas
 
-# output to csv
 
-with open(os.path.join(scl_dir, csv_file), 'w', newline='', encoding = 'utf-8') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['Timepoint'] + habitat_names)
-    for year in years:
-        data_list = []
-        for type in types:
-            data_list.append(df_hab_areas[year][type])
-        writer.writerow([year] + data_list)
+# output one row per year, habitat types in the order of types
+def write(df_hab_areas, scl_dir, years):
+    table = pd.DataFrame.from_dict(df_hab_areas, orient='index').reindex(index=years, columns=types)
+    scl_output.write_table(table.rename_axis('year').reset_index(), scl_dir, csv_file, ['Timepoint'] + habitat_names, sheet_name)
 
-            
-    
+
+scl_engine.register('habitat_trends', None, build, write, incremental=True, keys=[], plans=plans)
+
+
+if __name__ == '__main__':
+    scl_engine.main(['habitat_trends'], scl_dir, years)
@@ -19,10 +19,11 @@
 
 # imports
 import os
-import geopandas as gpd
 import pandas as pd
 import numpy as np
-import csv
+import scl_engine
+import scl_plan
+import scl_output
 
 
 # Set up
@@ -35,11 +36,12 @@ pivot_subdir = "pivot_tables\habitat_areas"
 datafiles = ["scl_species.geojson", "scl_species_fragment.geojson", "scl_survey.geojson", "scl_survey_fragment.geojson", "scl_restoration.geojson", "scl_restoration_fragment.geojson"]
 # csv output file
 csv_file = 'landscape_area_trends.csv'
+# sheet name in xlsx output
+sheet_name = 'Landscape area trends'
 
-# the years to analyze are:
-years = ['2020-01-01','2019-01-01','2018-01-01','2017-01-01','2016-01-01','2015-01-01','2014-01-01','2013-01-01','2012-01-01','2011-01-01','2010-01-01','2009-01-01','2008-01-01','2007-01-01','2006-01-01','2005-01-01','2004-01-01','2003-01-01','2002-01-01','2001-01-01']
-# a single year for testing purposes
-#years = ['2020-01-01']
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+# a single year for testing purposes:  --years 2020-01-01
 # habitat types to analyze are:
 types = ['eff_pot_hab_area']
 # variable names
@@ -47,34 +49,38 @@ landscape_names = ['Species conservation landscapes', 'Species fragments', 'Surv
 
 
 
-# make an empty dictionary to hold areas by year
-df_hab_areas = {}
+# the range-wide total area of each landscape type
+plans = {datafile: scl_plan.Plan(datafile).group_sum([], types) for datafile in datafiles}
 
-# loop over years and calculate pivot tables 
-for year in years:
-    
-    # create empty dictionary for this year
-    df_hab_areas[year] = {}
-
-    for datafile in datafiles:
-        print ("Working on", year, datafile)
-        # load gejson files into df
-        df = gpd.read_file(os.path.join(scl_dir, year, datafile))
-        # sum up eff_pot_hab_area; note using datafile as stand in for ls_type
-        df_hab_areas[year][datafile] = df['eff_pot_hab_area'].sum()
 
-#print(df_hab_areas)
+# loop over years and landscape types and pick up the summed area
+def build(dfs, years):
 
-# output to csv
+    # make an empty dictionary to hold areas by year
+    df_hab_areas = {}
 
-with open(os.path.join(scl_dir, csv_file), 'w', newline='', encoding = 'utf-8') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['Analysis date'] + landscape_names)
     for year in years:
-        data_list = []
+    
+        # create empty dictionary for this year
+        df_hab_areas[year] = {}
+
         for datafile in datafiles:
-            data_list.append(df_hab_areas[year][datafile])
-        writer.writerow([year] + data_list)
+            print ("Working on", year, datafile)
+            totals = dfs[(year, datafile)]
+            # summed eff_pot_hab_area; note using datafile as stand in for ls_type
+            df_hab_areas[year][datafile] = totals['eff_pot_hab_area'].iloc[0]
 
-            
-    
+    return df_hab_areas
+
+
+# output one row per year, landscape types in the order of datafiles
+def write(df_hab_areas, scl_dir, years):
+    table = pd.DataFrame.from_dict(df_hab_areas, orient='index').reindex(index=years, columns=datafiles)
+    scl_output.write_table(table.rename_axis('year').reset_index(), scl_dir, csv_file, ['Analysis date'] + landscape_names, sheet_name)
+
+
+scl_engine.register('landscape_trends', None, build, write, incremental=True, keys=[], plans=plans)
+
+
+if __name__ == '__main__':
+    scl_engine.main(['landscape_trends'], scl_dir, years)
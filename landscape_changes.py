@@ -0,0 +1,120 @@
+# landscape_changes.py
+
+# Goal:  generate a table of how each landscape changed over time, year over year and against the baseline year (2001)
+# for each landscape and comparison, provide its landscape type then and now, whether it appeared, disappeared, changed
+# type or continued, and the change in structural, effective potential and known occupied habitat
+# see notes in this Word doc:  SCL website rangewide table details 10-14-2022.docx (trends over time)
+
+# this script works off the same per-(year, lsid) sums of the six scl landscape geojsons as landscapes.py
+# they're kept as an incremental report, so the summed areas of every timepoint are cached as a parquet file per
+# timepoint next to the attribute cache (see scl_engine.py) and a rerun only sums the timepoints that are new or changed;
+# with a store they come straight from its aggregate index (see scl_index.py)
+# the comparisons are then a join of every timepoint against the one before it and against the baseline
+
+# run using Anaconda environment:  C:\Users\esanderson>conda activate scl
+
+# imports
+import numpy as np
+import pandas as pd
+import scl_engine
+import scl_plan
+import scl_output
+import landscapes
+
+# Set up
+
+# data files organized by folder by time point are in this directory:
+scl_dir = r"C:\proj\species\tigers\TCLs v3\TCL delineation\scl_stats_09142022"
+# data input files and their landscape types, as in the landscape list
+datafiles = landscapes.datafiles
+dict_landscape_names = landscapes.dict_landscape_names
+# csv output file
+csv_file = 'landscape_changes.csv'
+# sheet name in xlsx output
+sheet_name = 'Landscape changes'
+
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+# baseline timepoint year, the earliest timepoint is used if it isn't there
+baseline = '2001'
+# habitat types to compare are:
+types = ['str_hab_area','eff_pot_hab_area','occupied_eff_pot_hab_area']
+# variable names
+habitat_names = ['Structural habitat', 'Effective potential habitat', 'Known occupied habitat']
+# fieldnames
+fieldnames = (['Comparison','Analysis date','Compared with','Lsid','Landscape type','Previous landscape type','Name','Status']
+              + [name + suffix for name in habitat_names for suffix in ['', ' change', ' % change']])
+
+
+# for each landscape type, sum the habitat types by lsid
+plans = {datafile: scl_plan.Plan(datafile).group_sum(['lsid'], types) for datafile in datafiles}
+
+
+# loop over years and pick up the summed areas of every landscape, as a dataframe per year
+def build(dfs, years):
+
+    # make an empty dictionary to hold the landscapes by year
+    ls_areas = {}
+
+    for year in years:
+        print ("Working on", year)
+        ls_df = pd.concat([dfs[(year, datafile)].assign(lstype=dict_landscape_names[datafile]) for datafile in datafiles])
+        ls_areas[year] = pd.DataFrame({'lsid': ls_df.index.astype(str).to_numpy(), 'lstype': ls_df['lstype'].to_numpy(),
+                                       **{type: ls_df[type].astype(float).to_numpy() for type in types}})
+
+    return ls_areas
+
+
+# every landscape of one timepoint against the same landscape in the timepoint it's compared with
+# pairs has one row per comparison, the later timepoint in date and the earlier one in compared
+def compare(ls_df, pairs, comparison):
+    current = ls_df.merge(pairs, on='date')
+    previous = ls_df.rename(columns={'date': 'compared', 'lstype': 'prev_lstype', **{type: 'prev_' + type for type in types}}).merge(pairs, on='compared')
+    changes = current.merge(previous, on=['date','compared','lsid'], how='outer')
+
+    changes['comparison'] = comparison
+    changes['status'] = np.select([changes['prev_lstype'].isna(), changes['lstype'].isna(), changes['lstype'] != changes['prev_lstype']],
+                                  ['appeared', 'disappeared', 'changed type'], 'continuing')
+    # a landscape that's gone is listed under the type it had
+    changes['lstype'] = changes['lstype'].fillna(changes['prev_lstype'])
+    # a landscape that isn't there has no area
+    for type in types:
+        changes[type] = changes[type].fillna(0)
+        changes[type + '_change'] = changes[type] - changes['prev_' + type].fillna(0)
+        changes[type + '_pct'] = 100 * changes[type + '_change'] / changes['prev_' + type].replace(0, np.nan)
+    return changes
+
+
+# the year-over-year and baseline comparisons of every landscape, newest timepoint first, from the summed areas of every year
+def changes_table(ls_areas, years):
+    columns = (['comparison','date','compared','lsid','lstype','prev_lstype','name','status']
+               + [type + suffix for type in types for suffix in ['', '_change', '_pct']])
+    # nothing to compare with a single timepoint
+    if len(years) < 2:
+        return pd.DataFrame(columns=columns)
+    ls_df = pd.concat([ls_areas[year].assign(date=year) for year in years])
+    # a landscape should only be in one landscape type a year, but sum it up if it isn't
+    ls_df = ls_df.groupby(['date','lsid'], as_index=False).agg({'lstype': ' / '.join, **{type: 'sum' for type in types}})
+
+    ordered = sorted(years)
+    base = next((year for year in ordered if year.startswith(baseline)), ordered[0])
+    year_over_year = pd.DataFrame({'date': ordered[1:], 'compared': ordered[:-1]}, dtype=object)
+    from_baseline = pd.DataFrame({'date': [year for year in ordered if year != base], 'compared': base}, dtype=object)
+
+    changes = pd.concat([compare(ls_df, year_over_year, 'year over year'), compare(ls_df, from_baseline, 'since ' + base)])
+    changes = changes.sort_values(['comparison','date','lsid'], ascending=[False, False, True])
+    # placeholder, filled in from the landscape names registry by the engine (see scl_names.py)
+    changes['name'] = "tbd"
+    return changes[columns]
+
+
+# output the table in the configured formats (see scl_output.py)
+def write(changes, scl_dir, years):
+    scl_output.write_table(changes, scl_dir, csv_file, fieldnames, sheet_name)
+
+
+scl_engine.register('landscape_changes', None, build, write, incremental=True, keys=['lsid'], plans=plans, table=changes_table)
+
+
+if __name__ == '__main__':
+    scl_engine.main(['landscape_changes'], scl_dir, years)
@@ -12,16 +12,17 @@
 # there are six landscape types as defined in the landscape_names variable below
 
 # note:  landscapes have been subdivided by states/province boundaries, so it's necessary to sum up each on by lsid
-# note:  names are provided by joining with a separate file that gives names by year, landscape type, and lsid (tbd)
+# note:  names are provided by joining with a separate file that gives names by year, landscape type, and lsid (see scl_names.py)
 
 # run using Anaconda environment:  C:\Users\esanderson>conda activate scl
 
 # imports
 import os
-import geopandas as gpd
 import pandas as pd
 import numpy as np
-import csv
+import scl_engine
+import scl_plan
+import scl_output
 
 # Set up
 
@@ -33,11 +34,12 @@ pivot_subdir = "pivot_tables\habitat_areas"
 datafiles = ["scl_species.geojson", "scl_species_fragment.geojson", "scl_survey.geojson", "scl_survey_fragment.geojson", "scl_restoration.geojson", "scl_restoration_fragment.geojson"]
 # csv output file
 csv_file = 'landscape_list.csv'
+# sheet name in xlsx output
+sheet_name = 'Landscapes'
 
-# the years to analyze are:
-#years = ['2020-01-01','2019-01-01','2018-01-01','2017-01-01','2016-01-01','2015-01-01','2014-01-01','2013-01-01','2012-01-01','2011-01-01','2010-01-01','2009-01-01','2008-01-01','2007-01-01','2006-01-01','2005-01-01','2004-01-01','2003-01-01','2002-01-01','2001-01-01']
-# a single year for testing purposes
-years = ['2020-01-01']
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+# a single year for testing purposes:  --years 2020-01-01
 # habitat types to analyze are:
 types = ['str_hab_area','eff_pot_hab_area','occupied_eff_pot_hab_area', 'kba_eff_pot_hab_area', 'pa_eff_pot_hab_area']
 # a single type for testing purposes
@@ -46,51 +48,53 @@ types = ['str_hab_area','eff_pot_hab_area','occupied_eff_pot_hab_area', 'kba_eff
 landscape_names = ['species', 'species fragment', 'survey', 'survey fragment', 'restoration', 'restoration fragment']
 # fieldnames
 fieldnames = ['Analysis date','Lsid','Landcape type','Name','Structural habitat','Effective potential habitat','Known occupied habitat','%KBA','%Protected']
+# dataframe columns written under those fieldnames
+fields = ['date','lsid','lstype','name','str_hab_area','eff_pot_hab_area','occupied_eff_pot_hab_area','kba_frac','pa_frac']
 # use list comprehension to put landscape names with datafiles in dictionary
 dict_landscape_names = {datafiles[i]: landscape_names[i] for i in range(len(datafiles))}
 
 
-# make an empty dictionary to hold areas by year
-dict_pivots = {}
-
-# loop over datafiles
-for year in years:
-    for datafile in datafiles:
-        print ("Working on", year, datafile)
-        # load gejson files into df
-        df = gpd.read_file(os.path.join(scl_dir, year, datafile))
-
-        # for each habitat type, create pivot table using pandas summing areas by type
-        pivot_areas_df = pd.pivot_table(df, 
-            values = types,       
-            index = ['lsid'],
-            aggfunc = 'sum')
-
-        # add some additional columns for output
-        pivot_areas_df['date'] = year
-        pivot_areas_df['lsid'] = pivot_areas_df.index                   
-        pivot_areas_df['lstype'] = dict_landscape_names[datafile]
-        pivot_areas_df['name'] = "tbd"
-        pivot_areas_df['kba_frac'] = pivot_areas_df['kba_eff_pot_hab_area'] / pivot_areas_df['eff_pot_hab_area'] 
-        pivot_areas_df['pa_frac'] = pivot_areas_df['pa_eff_pot_hab_area'] / pivot_areas_df['eff_pot_hab_area'] 
-        #pivot_areas_df.drop(labels = ['kba_eff_pot_hab_area','pa_eff_pot_hab_area'], axis=1)
-        #print (datafile)
-
-        #print (pivot_areas_df.head())
-        dict_pivots[datafile] = pivot_areas_df
-
-# export to csv
-# write header
-with open(os.path.join(scl_dir, csv_file), 'w', newline='', encoding = 'utf-8') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(fieldnames)
-# write to csv from pandas
-for year in years:
-    data_list = []
-    for datafile in datafiles:
-        #print(datafile)
-        #for col in dict_pivots[datafile].columns:
-        #    print (col)
-        #print(dict_pivots[datafile].head())
-        fields= ['date','lsid','lstype','name','str_hab_area','eff_pot_hab_area','occupied_eff_pot_hab_area','kba_frac','pa_frac']
-        dict_pivots[datafile].to_csv(os.path.join(scl_dir, csv_file), columns = fields, header=False, index = False, mode='a')
\ No newline at end of file
+# for each landscape type, sum the habitat types by lsid and work out the fraction of each landscape in KBAs and PAs
+plans = {datafile: scl_plan.Plan(datafile).group_sum(['lsid'], types)
+                                          .ratio('kba_frac', 'kba_eff_pot_hab_area', 'eff_pot_hab_area')
+                                          .ratio('pa_frac', 'pa_eff_pot_hab_area', 'eff_pot_hab_area')
+         for datafile in datafiles}
+
+
+# loop over years and datafiles and fill out the landscape tables, returning one table for all of them
+def build(dfs, years):
+
+    # make an empty list to hold the pivot tables, in output order (by year, then landscape type)
+    pivots = []
+
+    for year in years:
+        for datafile in datafiles:
+            print ("Working on", year, datafile)
+            # areas summed by lsid, with kba_frac and pa_frac, from the plan
+            pivot_areas_df = dfs[(year, datafile)]
+
+            # add some additional columns for output
+            pivot_areas_df['date'] = year
+            pivot_areas_df['lsid'] = pivot_areas_df.index                   
+            pivot_areas_df['lstype'] = dict_landscape_names[datafile]
+            # placeholder, filled in from the landscape names registry by the engine (see scl_names.py)
+            pivot_areas_df['name'] = "tbd"
+
+            pivots.append(pivot_areas_df)
+
+    # stack every year and landscape type into a single table
+    if not pivots:
+        return pd.DataFrame(columns=fields)
+    return pd.concat(pivots)
+
+
+# export the table in the configured formats (see scl_output.py)
+def write(pivot_areas_df, scl_dir, years):
+    scl_output.write_table(pivot_areas_df[fields], scl_dir, csv_file, fieldnames, sheet_name)
+
+
+scl_engine.register('landscape_list', None, build, write, keys=['lsid'], plans=plans)
+
+
+if __name__ == '__main__':
+    scl_engine.main(['landscape_list'], scl_dir, years)
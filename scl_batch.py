@@ -0,0 +1,172 @@
+# scl_batch.py
+
+# Goal:  produce the SCL website tables for several species and analysis releases in one batch
+#
+# a job is a species and the release folder of its SCL outputs (e.g. Panthera_tigris and ...\scl_stats_09142022)
+# every job is run by the engine (see scl_engine.py) at the same time as the others, and all their
+# (year, datafile) loads go to one shared pool of worker processes, so the machine stays busy between jobs
+# each job writes its reports to its own folder:  <out_dir>/<species>/<release folder name>
+# a job that fails (missing inputs, a bad geojson, ...) is reported at the end and doesn't stop the others
+# if a worker process dies (e.g. killed for running out of memory) the shared pool is broken for every job using it,
+# so it's replaced with a fresh one and the jobs that were caught by it are run again on that
+# jobs on the same release folder (e.g. written to two output folders) share its cache and manifest, so they're run
+# one after the other rather than at the same time
+#
+# jobs are given on the command line, or as a csv file of species,release_dir lines (with an optional third out_dir column)
+#
+# example:  python scl_batch.py --job Panthera_tigris "C:\proj\...\scl_stats_09142022" --job Panthera_tigris D:\scl_stats_03012023
+#           python scl_batch.py --jobs jobs.csv --out-dir D:\scl_reports_out --workers 12
+
+# imports
+import os
+import sys
+import csv
+import argparse
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import scl_data
+import scl_engine
+import scl_output
+import scl_profile
+# importing the report scripts registers them with the engine
+import habitat_area_trends
+import landscape_area_trends
+import landscapes
+import species_landscape_by_admin
+import species_landscapes_by_biome
+import landscape_changes
+
+
+# Set up
+
+# default folder the job outputs go under
+out_dir = "scl_reports_out"
+# times a job is run again on a fresh pool after the shared one broke under it
+pool_retries = 1
+
+
+# read a jobs csv of species,release_dir[,out_dir] lines into a list of (species, release_dir, out_dir) jobs
+def read_jobs(path):
+    jobs = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            row = [field.strip() for field in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            jobs.append((row[0], row[1], row[2] if len(row) > 2 and row[2] else None))
+    return jobs
+
+
+# output folder of a job that didn't give its own
+def job_dir(root, species, release_dir):
+    return os.path.join(root, species, os.path.basename(os.path.normpath(release_dir)))
+
+
+# the shared pool of worker processes, started with spawn rather than fork, as forking a process that's running
+# threads can deadlock
+def new_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+# swap the batch's broken pool for a fresh one and return it; only the first job to notice a broken pool replaces it,
+# the others pick up its replacement
+def replace_pool(shared, broken):
+    with shared['lock']:
+        if shared['pool'] is broken:
+            broken.shutdown(wait=False)
+            shared['pool'] = new_pool(shared['workers'])
+        return shared['pool']
+
+
+# run one job, catching whatever goes wrong so the other jobs carry on
+# shared is the batch's pool as a dictionary of pool, workers and lock (None to load in this process), so jobs see a
+# replacement pool when one is started; a job caught by a broken pool is run again on the new one
+# release_lock is held for the whole job, so no other job runs on the same release folder in the meantime
+def run_job(job, names, years, shared, release_lock, **options):
+    species, release_dir, job_out_dir = job
+    with release_lock:
+        pool = shared['pool'] if shared is not None else None
+        for attempt in range(pool_retries + 1):
+            try:
+                scl_engine.run(release_dir, years, names, pool=pool, out_dir=job_out_dir, **options)
+                return None
+            except BrokenProcessPool:
+                if shared is None or attempt == pool_retries:
+                    return traceback.format_exc()
+                pool = replace_pool(shared, pool)
+            except Exception:
+                return traceback.format_exc()
+
+
+# run every job on one shared pool of worker processes
+# jobs is a list of (species, release_dir, out_dir) with out_dir = None meaning <root>/<species>/<release folder name>
+# concurrent is the number of jobs run at a time (default all of them); the loads of every running job share the
+# worker processes, while each job's plans and builds run in its own thread
+# returns a dictionary of job -> None if it succeeded or the traceback of its failure
+def run_batch(jobs, names, years=None, workers=1, concurrent=None, root=out_dir, **options):
+    jobs = [(species, release_dir, job_out_dir or job_dir(root, species, release_dir)) for species, release_dir, job_out_dir in jobs]
+    if len(set(job[2] for job in jobs)) < len(jobs):
+        raise ValueError('two jobs would write to the same output folder')
+    shared = {'pool': new_pool(workers), 'workers': workers, 'lock': threading.Lock()} if workers > 1 else None
+    # one lock per release folder, however its path is spelled
+    release_locks = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrent or len(jobs)) as threads:
+            futures = {}
+            for job in jobs:
+                release_lock = release_locks.setdefault(os.path.normcase(os.path.realpath(job[1])), threading.Lock())
+                futures[job] = threads.submit(run_job, job, names, years, shared, release_lock, workers=workers, **options)
+            return {job: future.result() for job, future in futures.items()}
+    finally:
+        if shared is not None:
+            shared['pool'].shutdown()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--job', nargs=2, action='append', default=[], metavar=('SPECIES', 'RELEASE_DIR'), help='a species and the release folder of its SCL outputs (repeatable)')
+    parser.add_argument('--jobs', default=None, metavar='CSV', help='csv file of species,release_dir[,out_dir] jobs')
+    parser.add_argument('--out-dir', default=out_dir, help='folder the job outputs go under, as <out_dir>/<species>/<release folder name>')
+    parser.add_argument('--years', nargs='+', default=None, help='timepoints to report on (default: every timepoint found in each release)')
+    parser.add_argument('--reports', nargs='+', default=list(scl_engine.reports), choices=sorted(scl_engine.reports), help='reports to produce')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes shared by every job to load the geojson files (1 = serial)')
+    parser.add_argument('--concurrent', type=int, default=None, help='number of jobs run at a time (default: all of them)')
+    parser.add_argument('--prefetch', type=int, default=scl_data.default_prefetch, metavar='N', help='inputs each job reads ahead in background threads (see scl_engine.py)')
+    parser.add_argument('--float32', action='store_true', help='hold the loaded area columns as float32 (see scl_engine.py)')
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='N', help='sum large inputs in batches of N features (see scl_engine.py)')
+    parser.add_argument('--formats', nargs='+', default=['csv'], choices=scl_output.all_formats, help='output formats for every table (default csv)')
+    parser.add_argument('--no-atomic', action='store_true', help='write the tables in place instead of renaming complete files into place')
+    parser.add_argument('--rebuild', action='store_true', help='recompute every year instead of re-using stored results for unchanged inputs')
+    parser.add_argument('--profile', nargs='?', const='scl_profile.json', default=None, metavar='TRACE', help='record and summarize every phase across all the jobs')
+    args = parser.parse_args()
+
+    jobs = [(species, release_dir, None) for species, release_dir in args.job]
+    if args.jobs:
+        jobs += read_jobs(args.jobs)
+    if not jobs:
+        parser.error('no jobs given; use --job SPECIES RELEASE_DIR or --jobs CSV')
+
+    scl_profile.enable(args.profile is not None)
+    scl_output.configure(args.formats, not args.no_atomic)
+
+    try:
+        status = run_batch(jobs, args.reports, args.years, args.workers, args.concurrent, args.out_dir,
+                        rebuild=args.rebuild, chunk_size=args.chunk_size, prefetch=args.prefetch, float32=args.float32)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for job, error in status.items():
+        print ("%-8s %s %s -> %s" % ('failed' if error else 'ok', job[0], job[1], job[2]))
+    for job, error in status.items():
+        if error:
+            print ("\n" + job[0] + " " + job[1] + ":\n" + error)
+
+    if args.profile is not None:
+        scl_profile.print_summary()
+        scl_profile.write_trace(args.profile)
+
+    sys.exit(1 if any(status.values()) else 0)
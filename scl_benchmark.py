@@ -0,0 +1,279 @@
+# scl_benchmark.py
+
+# Goal:  measure how the SCL reports scale, using synthetic SCL pipeline outputs instead of a real scl_stats download
+#
+# generates a scl_dir tree of date-named timepoint folders holding scl_states.geojson and the six landscape geojsons,
+# with configurable numbers of years, features, polygon vertices and ecoregions per feature
+# then times each report's load (cold = geojson parse, warm = parquet cache), build, table (for reports that compare
+# years, e.g. the change report's cross-year merge) and write phases,
+# plus a full single-pass engine run, and records how much memory each phase takes
+#
+# the timings are taken with nothing watching the memory, so they aren't slowed down by it; the memory is measured in a
+# separate pass, with each phase run again in a fresh python process that samples its resident memory (RSS) while the
+# phase runs, so it counts pyarrow's buffers too and isn't thrown off by whatever earlier phases left behind
+# with --workers the peak RSS of the worker processes is recorded alongside
+#
+# results are written as json so runs can be compared across changes
+# runs offline on plain linux; nothing but the report dependencies is needed
+#
+# example:  python scl_benchmark.py --years 20 --features 5000 --vertices 500 --out bench_results.json
+
+# imports
+import os
+import sys
+import gc
+import json
+import math
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import scl_data
+import scl_plan
+import scl_engine
+import scl_profile
+# importing the report scripts registers them with the engine
+import habitat_area_trends
+import landscape_area_trends
+import landscapes
+import species_landscape_by_admin
+import species_landscapes_by_biome
+import landscape_changes
+
+
+# Set up
+
+# datafiles written for every synthetic timepoint
+datafiles = ['scl_states.geojson'] + landscape_area_trends.datafiles
+# countries assigned to the synthetic features
+countries = ['India', 'Nepal', 'Bhutan', 'Bangladesh', 'Myanmar', 'Thailand', 'Malaysia', 'Indonesia', 'Russia', 'China', 'Laos', 'Cambodia', 'Vietnam']
+# biomes drawn from for the ecoregions json
+biomes = species_landscapes_by_biome.biome_order
+
+
+# one synthetic feature
+# the polygon is a ring of n vertices around a random centre, the areas are consistent with each other
+# (occupied <= effective potential <= structural <= indigenous range) and the ecoregions split the effective potential area
+def make_feature(rng, fid, lsid, n_vertices, n_ecoregions):
+    eff = rng.uniform(1, 1000)
+    shares = [rng.random() for i in range(n_ecoregions)]
+    ecoregions = [{'biome_name': rng.choice(biomes), 'eff_pot_hab_area': eff * s / sum(shares)} for s in shares]
+    properties = {
+        'id': '%020d_%020d' % (1, fid),
+        'lsid': '%020d_%020d' % (1, lsid),
+        'country': rng.choice(countries),
+        'indigenous_range_area': eff * 4,
+        'str_hab_area': eff * 2,
+        'eff_pot_hab_area': eff,
+        'occupied_eff_pot_hab_area': eff * rng.random(),
+        'kba_eff_pot_hab_area': eff * rng.random(),
+        'pa_eff_pot_hab_area': eff * rng.random(),
+        'ecoregions': json.dumps(ecoregions),
+    }
+    x, y, r = rng.uniform(70, 130), rng.uniform(-10, 50), rng.uniform(0.01, 0.5)
+    ring = [[x + r * math.cos(2 * math.pi * i / n_vertices), y + r * math.sin(2 * math.pi * i / n_vertices)] for i in range(n_vertices)]
+    ring.append(ring[0])
+    geometry = {'type': 'MultiPolygon', 'coordinates': [[ring]]}
+    return {'type': 'Feature', 'id': str(fid), 'properties': properties, 'geometry': geometry}
+
+
+# write one synthetic geojson, one feature at a time so the generator itself stays small in memory
+def write_geojson(path, rng, n_features, n_landscapes, n_vertices, n_ecoregions):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for fid in range(n_features):
+            if fid:
+                f.write(',\n')
+            f.write(json.dumps(make_feature(rng, fid, fid % n_landscapes, n_vertices, n_ecoregions)))
+        f.write('\n]}\n')
+
+
+# build a synthetic scl_dir with n_years timepoints (newest 2020-01-01, going back a year at a time)
+def generate(scl_dir, n_years, n_features, n_landscapes, n_vertices, n_ecoregions, seed=0):
+    rng = random.Random(seed)
+    for i in range(n_years):
+        year = '%d-01-01' % (2020 - i)
+        os.makedirs(os.path.join(scl_dir, year), exist_ok=True)
+        for datafile in datafiles:
+            write_geojson(os.path.join(scl_dir, year, datafile), rng, n_features, n_landscapes, n_vertices, n_ecoregions)
+
+
+# run fn() and return its result with the wall time of the call
+def measure(fn):
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    return result, {'seconds': time.perf_counter() - start}
+
+
+# run fn() while a background thread samples the RSS of this process; returns the most it grew above where it started
+def rss_growth(fn, interval=0.005):
+    gc.collect()
+    start = scl_profile.current_rss()
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], scl_profile.current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak[0], scl_profile.current_rss()) - start
+
+
+# build one report from its loaded frames, collecting its plans first if it declares any
+def build_report(report, dfs, years):
+    if report['plans'] is not None:
+        results = {}
+        for year in years:
+            frames = {datafile: dfs[(year, datafile)] for datafile in report['inputs']}
+            results.update({(year, plan_name): df for plan_name, df in scl_plan.collect_all(report['plans'], frames).items()})
+        dfs = results
+    return report['build'](dfs, years)
+
+
+# get ready to run one benchmarked phase and return it as a function of no arguments
+# name is a report (phases load_cold, load_warm, build, table and write) or 'engine' (phases cold, warm and single_year)
+# whatever the phase needs is done here, e.g. loading the frames a build works on, so it isn't part of the phase
+def prepare(scl_dir, name, phase, workers):
+    cache = os.path.join(scl_dir, scl_data.cache_subdir)
+    if name == 'engine':
+        names = list(scl_engine.reports)
+        years = list(scl_data.discover(scl_dir))[:1] if phase == 'single_year' else None
+        run = lambda: scl_engine.run(scl_dir, years, names, workers=workers, rebuild=True)
+        if phase == 'cold':
+            shutil.rmtree(cache, ignore_errors=True)
+        elif not os.path.exists(cache):
+            run()
+        return run
+
+    report = scl_engine.reports[name]
+    years = list(scl_data.discover(scl_dir))
+    items = [(year, datafile) for year in years for datafile in report['inputs']]
+    load = lambda: scl_data.load_many(scl_dir, items, columns=report['inputs'], workers=workers)
+    if phase == 'load_cold':
+        shutil.rmtree(cache, ignore_errors=True)
+        return load
+    dfs = load()
+    if phase == 'load_warm':
+        return load
+    if phase == 'build':
+        return lambda: build_report(report, dfs, years)
+    result = build_report(report, dfs, years)
+    if phase == 'table':
+        return lambda: report['table'](result, years)
+    if report['table'] is not None:
+        result = report['table'](result, years)
+    return lambda: report['write'](result, scl_dir, years)
+
+
+# the memory of one phase, measured in a fresh python process (see memory_pass below)
+def measure_memory(scl_dir, name, phase, workers):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--memory-pass', name, phase, '--scl-dir', scl_dir,
+                             '--workers', str(workers)], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+# time one phase, then measure its memory in a separate pass
+def bench_phase(scl_dir, name, phase, workers):
+    _, stats = measure(prepare(scl_dir, name, phase, workers))
+    stats.update(measure_memory(scl_dir, name, phase, workers))
+    return stats
+
+
+# run one phase in this (fresh) process and print how much its RSS grew, and with worker processes their peak RSS
+def memory_pass(scl_dir, name, phase, workers):
+    stats = {'rss_growth_bytes': rss_growth(prepare(scl_dir, name, phase, workers))}
+    if workers > 1 and scl_profile.resource is not None:
+        # the largest of the finished worker processes; linux reports ru_maxrss in kilobytes, macos in bytes
+        maxrss = scl_profile.resource.getrusage(scl_profile.resource.RUSAGE_CHILDREN).ru_maxrss
+        stats['workers_peak_rss_bytes'] = maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+    print (json.dumps(stats))
+
+
+# time the load (cold and warm), build, table (if the report has one) and write phases of one report over every year in scl_dir
+def bench_report(scl_dir, name, workers):
+    report = scl_engine.reports[name]
+    years = list(scl_data.discover(scl_dir))
+    items = [(year, datafile) for year in years for datafile in report['inputs']]
+    phases = ['load_cold', 'load_warm', 'build'] + (['table'] if report['table'] is not None else []) + ['write']
+    phases = {phase: bench_phase(scl_dir, name, phase, workers) for phase in phases}
+    dfs = scl_data.load_many(scl_dir, items, columns=report['inputs'], workers=workers)
+
+    return {
+        'rows': sum(len(df) for df in dfs.values()),
+        'input_bytes': sum(os.path.getsize(os.path.join(scl_dir, year, datafile)) for year, datafile in items),
+        'phases': phases,
+    }
+
+
+# time a full single-pass engine run of every report, from an empty cache and then from a warm one,
+# plus a run of the newest timepoint alone (the single year testing mode, where the cross-year reports have nothing to compare)
+def bench_engine(scl_dir, workers):
+    return {phase: bench_phase(scl_dir, 'engine', phase, workers) for phase in ['cold', 'warm', 'single_year']}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=3, help='number of synthetic timepoints')
+    parser.add_argument('--features', type=int, default=1000, help='features per geojson')
+    parser.add_argument('--landscapes', type=int, default=100, help='distinct lsids per geojson')
+    parser.add_argument('--vertices', type=int, default=100, help='vertices per polygon')
+    parser.add_argument('--ecoregions', type=int, default=3, help='ecoregions per feature')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes used to load the geojson files')
+    parser.add_argument('--reports', nargs='+', default=None, help='reports to benchmark (default: all)')
+    parser.add_argument('--scl-dir', default=None, help='folder for the synthetic data (default: a temporary folder, removed afterwards)')
+    parser.add_argument('--out', default='bench_results.json', help='json file the results are written to')
+    parser.add_argument('--memory-pass', nargs=2, default=None, metavar=('REPORT', 'PHASE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # the separate memory pass of one phase, run by the benchmark itself in a fresh process
+    if args.memory_pass:
+        memory_pass(args.scl_dir, args.memory_pass[0], args.memory_pass[1], args.workers)
+        sys.exit(0)
+
+    scl_dir = args.scl_dir or tempfile.mkdtemp(prefix='scl_bench_')
+    try:
+        print ("Generating synthetic data in", scl_dir)
+        _, generate_stats = measure(lambda: generate(scl_dir, args.years, args.features, args.landscapes, args.vertices, args.ecoregions))
+
+        results = {
+            'params': {k: v for k, v in vars(args).items() if k not in ('out', 'scl_dir')},
+            'platform': {'python': sys.version.split()[0], 'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'generate': generate_stats,
+            'reports': {},
+        }
+        for name in args.reports or list(scl_engine.reports):
+            print ("Benchmarking", name)
+            results['reports'][name] = bench_report(scl_dir, name, args.workers)
+        print ("Benchmarking single-pass engine")
+        results['engine'] = bench_engine(scl_dir, args.workers)
+        results['peak_rss_bytes'] = scl_profile.peak_rss()
+    finally:
+        if args.scl_dir is None:
+            shutil.rmtree(scl_dir, ignore_errors=True)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+
+    # summary table
+    print ("%-18s %10s %10s %10s %10s %10s %12s" % ('report', 'cold (s)', 'warm (s)', 'build (s)', 'table (s)', 'write (s)', 'grown (MB)'))
+    for name, r in results['reports'].items():
+        p = r['phases']
+        grown = max(phase['rss_growth_bytes'] for phase in p.values()) / 1e6
+        table = '%10.3f' % p['table']['seconds'] if 'table' in p else '%10s' % '-'
+        print ("%-18s %10.3f %10.3f %10.3f %s %10.3f %12.1f" % (name, p['load_cold']['seconds'], p['load_warm']['seconds'], p['build']['seconds'], table, p['write']['seconds'], grown))
+    e = results['engine']
+    print ("engine: cold %.3f s (%.1f MB), warm %.3f s (%.1f MB), single year %.3f s (%.1f MB)"
+           % tuple(x for phase in ('cold', 'warm', 'single_year') for x in (e[phase]['seconds'], e[phase]['rss_growth_bytes'] / 1e6)))
@@ -0,0 +1,367 @@
+# scl_data.py
+
+# Goal:  shared loader for the SCL pipeline geojson outputs used by all the report scripts
+#
+# the reports only ever use the attribute columns of scl_states.geojson and the scl landscape geojsons, never the geometry,
+# so each (year, datafile) is parsed once and its attributes are kept in a columnar (parquet) cache in scl_dir
+# later runs read only the columns a report asks for straight from the cache
+#
+# cache files are keyed by a hash of the geojson contents, so a re-downloaded or re-run timepoint is picked up automatically
+# a manifest in the cache folder records the size, mtime and hash of every input seen so far (plus the per-year results
+# of the incremental reports, see scl_engine.py), so unchanged files don't even need to be re-hashed
+#
+# timepoints are discovered from the date-named subfolders of scl_dir (e.g. 2020-01-01) rather than listed by hand
+#
+# geojsons are read with an incremental json parser that only builds the "properties" object of each feature,
+# so memory is bounded by the selected columns rather than by the polygon vertex count
+#
+# loaded frames are compacted (see compact): only the columns the reports asked for are read, key columns such as lsid
+# and country become categoricals, and with float32 the area columns are downcast
+#
+# for files too big to hold even their attribute columns in memory, aggregate_attributes reads the features in
+# fixed-size batches and keeps running sums per group key (e.g. lsid, or lsid and country), so peak memory
+# depends on the number of distinct keys rather than the number of features
+
+# imports
+import os
+import re
+import json
+import hashlib
+import itertools
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import ijson
+import pandas as pd
+import pyarrow.parquet as pq
+import scl_profile
+
+
+# Set up
+
+# subdirectory of scl_dir holding the parquet cache
+cache_subdir = ".scl_cache"
+# read size used when hashing input files
+hash_blocksize = 1 << 20
+# manifest of input files and incremental report results, in the cache subdirectory
+manifest_file = "manifest.json"
+# timepoint subfolders are named by date
+year_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# SCL pipeline outputs inside each timepoint subfolder
+datafile_pattern = re.compile(r'^scl_.*\.geojson$')
+
+
+# find the timepoint subfolders of scl_dir and the scl_*.geojson files in each
+# returns a dictionary of year -> sorted list of datafiles, newest year first
+def discover(scl_dir):
+    found = {}
+    for year in sorted(os.listdir(scl_dir), reverse=True):
+        if year_pattern.match(year) and os.path.isdir(os.path.join(scl_dir, year)):
+            found[year] = sorted(f for f in os.listdir(os.path.join(scl_dir, year)) if datafile_pattern.match(f))
+    return found
+
+
+# the (year, datafile) inputs that aren't in the discovered set
+def missing_inputs(found, items):
+    return [(year, datafile) for year, datafile in items if datafile not in found.get(year, [])]
+
+
+# features per batch when aggregating in chunks
+default_batch_size = 100000
+# items read ahead of the one being worked on by iter_many
+default_prefetch = 2
+# key columns stored as categoricals in loaded frames
+category_columns = ['id','lsid','country','biome_name']
+
+
+# hash the contents of a file, reading it in blocks so large geojsons don't have to fit in memory
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(hash_blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# temporary name a file is written to before it's renamed into place at path
+# it's unique to the process and thread, so runs writing the same file at the same time never share one
+def tmp_name(path):
+    return path + '.tmp' + str(os.getpid()) + '_' + str(threading.get_ident())
+
+
+# read a json file, or return default if it isn't there
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# write a json file via a temporary file so a crashed run never leaves it half written
+# numpy scalars are stored as plain python numbers
+def write_json(path, obj):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = tmp_name(path)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, indent=1, default=lambda o: o.item())
+    os.replace(tmp_path, path)
+
+
+# read the manifest for scl_dir, or start an empty one
+def read_manifest(scl_dir):
+    return read_json(os.path.join(scl_dir, cache_subdir, manifest_file), {'files': {}, 'reports': {}})
+
+
+# write the manifest for scl_dir (see write_json)
+def write_manifest(scl_dir, manifest):
+    write_json(os.path.join(scl_dir, cache_subdir, manifest_file), manifest)
+
+
+# content hash of scl_dir/year/datafile, re-using the manifest entry when the file size and mtime haven't changed
+# the manifest entry is updated in place when the file is new or has changed
+def file_digest(scl_dir, year, datafile, manifest):
+    path = os.path.join(scl_dir, year, datafile)
+    stat = os.stat(path)
+    key = year + '/' + datafile
+    entry = manifest['files'].get(key)
+    if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+        with scl_profile.phase('hash', year=year, datafile=datafile) as p:
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': file_hash(path)}
+            p['bytes_read'] = stat.st_size
+        manifest['files'][key] = entry
+    return entry['hash']
+
+
+# path of the cached attribute table for a given (year, datafile) and content hash
+def cache_path(scl_dir, year, datafile, digest):
+    stem = os.path.splitext(datafile)[0]
+    return os.path.join(scl_dir, cache_subdir, year, stem + '_' + digest[:16] + '.parquet')
+
+
+# path of the cached per-year result of an incremental report (see scl_engine.py), next to the attribute cache
+# key is a hash of the inputs and load options the result was built from
+def result_path(scl_dir, year, name, key):
+    return os.path.join(scl_dir, cache_subdir, year, 'reports', name + '_' + key[:16] + '.parquet')
+
+
+# stream the "properties" of each feature in a geojson FeatureCollection
+# geometry is tokenized by the parser but never decoded into python objects
+def iter_properties(path):
+    with open(path, 'rb') as f:
+        for props in ijson.items(f, 'features.item.properties', use_float=True):
+            yield props or {}
+
+
+# read the attributes of a geojson into a plain dataframe (no geometry), keeping only the requested columns
+# columns = None keeps every property, in the order they are first seen
+def read_properties(path, columns=None):
+    data = {} if columns is None else {col: [] for col in columns}
+    n = 0
+    for props in iter_properties(path):
+        if columns is None:
+            # a property missing from earlier features gets filled with None for those rows
+            for col in props:
+                if col not in data:
+                    data[col] = [None] * n
+        for col, values in data.items():
+            values.append(props.get(col))
+        n += 1
+    return pd.DataFrame(data, columns=list(data))
+
+
+# write a dataframe to parquet via a temporary file so a crashed run never leaves a partial cache entry
+# categoricals are written as plain strings, so every file of a dataset has the same schema whatever its categories
+def write_cache(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    tmp_path = tmp_name(path)
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+# load the attribute columns of scl_dir/year/datafile, parsing the geojson only if it isn't cached yet
+# columns = None returns all attributes; digest is the file's content hash if the caller already knows it
+def load_attributes(scl_dir, year, datafile, columns=None, digest=None):
+    path = os.path.join(scl_dir, year, datafile)
+    if digest is None:
+        digest = file_hash(path)
+    cached = cache_path(scl_dir, year, datafile, digest)
+
+    if not os.path.exists(cached):
+        # cache everything but geometry so any later column selection can be served from the cache
+        with scl_profile.phase('read_geojson', year=year, datafile=datafile) as p:
+            df = read_properties(path)
+            p['rows'] = len(df)
+            p['bytes_read'] = os.path.getsize(path)
+        with scl_profile.phase('write_cache', year=year, datafile=datafile) as p:
+            write_cache(df, cached)
+            p['rows'] = len(df)
+
+    with scl_profile.phase('read_cache', year=year, datafile=datafile) as p:
+        df = pd.read_parquet(cached, columns=columns)
+        p['rows'] = len(df)
+        p['bytes_read'] = os.path.getsize(cached)
+    return df
+
+
+# stream the attributes of a geojson as dataframes of at most batch_size rows, keeping only the requested columns
+def iter_property_batches(path, columns, batch_size=default_batch_size):
+    batch = []
+    for props in iter_properties(path):
+        batch.append([props.get(col) for col in columns])
+        if len(batch) == batch_size:
+            yield pd.DataFrame(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=columns)
+
+
+# read a parquet file as dataframes of at most batch_size rows, keeping only the requested columns
+def iter_parquet_batches(path, columns, batch_size=default_batch_size):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+
+# sum the values columns of a stream of dataframes by the keys columns, one batch at a time
+# only the running sums are kept between batches; keys = [] gives a single row of totals
+# rows with a missing key are kept as their own group, so totals over every row (e.g. the range-wide trend totals)
+# still add up; reports summing by that key drop them when they roll up, as the unchunked path does (see scl_plan.py)
+def aggregate_batches(batches, keys, values):
+    total = None
+    for batch in batches:
+        if keys:
+            part = batch.groupby(keys, dropna=False)[values].sum()
+        else:
+            part = batch[values].sum().to_frame().T
+        total = part if total is None else total.add(part, fill_value=0)
+    if total is None:
+        return pd.DataFrame(columns=keys + values)
+    return total.reset_index() if keys else total.reset_index(drop=True)
+
+
+# sum the values columns of scl_dir/year/datafile by the keys columns without ever holding all of its rows
+# reads the parquet cache in batches if this version of the file is already cached, otherwise streams the geojson
+def aggregate_attributes(scl_dir, year, datafile, keys, values, batch_size=default_batch_size, digest=None):
+    path = os.path.join(scl_dir, year, datafile)
+    if digest is None:
+        digest = file_hash(path)
+    cached = cache_path(scl_dir, year, datafile, digest)
+
+    with scl_profile.phase('read_chunked', year=year, datafile=datafile) as p:
+        if os.path.exists(cached):
+            batches = iter_parquet_batches(cached, keys + values, batch_size)
+            p['bytes_read'] = os.path.getsize(cached)
+        else:
+            batches = iter_property_batches(path, keys + values, batch_size)
+            p['bytes_read'] = os.path.getsize(path)
+        df = aggregate_batches(batches, keys, values)
+        p['rows'] = len(df)
+    return df
+
+
+# memory held by a dataframe, including its strings and index, in bytes
+def memory(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+# shrink a loaded frame in place: the key columns become categoricals (an integer code per row plus one copy of each
+# distinct string) and with float32 the float64 area columns are downcast
+# key columns with missing values are left alone, as pandas 1.x groupby drops missing categorical keys even with dropna=False
+def compact(df, float32=False):
+    for col in df.columns:
+        if col in category_columns and df[col].dtype == object and df[col].notna().all():
+            df[col] = df[col].astype('category')
+        elif float32 and col.endswith('_area') and df[col].dtype == 'float64':
+            df[col] = df[col].astype('float32')
+    return df
+
+
+# compact a loaded frame, recording its memory before and after when profiling
+def compact_profiled(df, float32, year, datafile):
+    with scl_profile.phase('compact', year=year, datafile=datafile) as p:
+        if scl_profile.enabled:
+            p['bytes_before'] = memory(df)
+        df = compact(df, float32)
+        if scl_profile.enabled:
+            p['bytes_after'] = memory(df)
+        p['rows'] = len(df)
+    return df
+
+
+# load one (year, datafile) item: the full attribute columns, or their sums by keys when keys is not None, compacted
+def load_one(scl_dir, year, datafile, columns, digest=None, keys=None, batch_size=default_batch_size, float32=False):
+    if keys is None:
+        df = load_attributes(scl_dir, year, datafile, columns, digest)
+    else:
+        df = aggregate_attributes(scl_dir, year, datafile, keys, [col for col in columns if col not in keys], batch_size, digest)
+    return compact_profiled(df, float32, year, datafile)
+
+
+# load one (year, datafile) item in a worker process, handing back any profiling records made there
+# module level so it can be sent to worker processes
+def load_item(args):
+    profiling = args[-1]
+    scl_profile.enable(profiling)
+    return load_one(*args[:-1]), scl_profile.records
+
+
+# run fn over args on an executor, yielding the results in order while keeping at most depth calls in flight,
+# so the next calls run in the background while the caller works on the current result
+def prefetch(executor, fn, args, depth):
+    args = iter(args)
+    futures = collections.deque(executor.submit(fn, a) for a in itertools.islice(args, max(depth, 1)))
+    while futures:
+        future = futures.popleft()
+        for a in itertools.islice(args, 1):
+            futures.append(executor.submit(fn, a))
+        yield future.result()
+
+
+# load one item in a prefetch thread, which shares the profiling records of this process
+def load_args(args):
+    return load_one(*args[:-1])
+
+
+# load the attribute columns for a list of (year, datafile) pairs, yielding ((year, datafile), df) in the order of items
+# columns is either one list for every datafile or a dictionary of datafile -> list of columns
+# digests is an optional dictionary of (year, datafile) -> content hash (see file_digest)
+# aggregate is an optional dictionary of datafile -> group keys; those datafiles are summed by their keys
+# in batches of batch_size features (see aggregate_attributes) instead of being loaded whole
+# workers > 1 spreads the loads over a pool of worker processes, and pool is an optional executor shared with
+# other runs (see scl_batch.py) that's used instead of starting one here
+# otherwise the next prefetch items are read in background threads while the caller works on the current one
+# (prefetch = 0 loads serially); either way at most prefetch (or workers) items are loaded ahead of the caller,
+# which bounds memory, and results come in the order of items whatever order the loads finish in
+# float32 downcasts the area columns (see compact)
+def iter_many(scl_dir, items, columns=None, workers=1, digests=None, aggregate=None, batch_size=default_batch_size, pool=None,
+              prefetch_depth=default_prefetch, float32=False):
+    items = [tuple(item) for item in items]
+    digests = digests or {}
+    aggregate = aggregate or {}
+    args = [(scl_dir, year, datafile, columns[datafile] if isinstance(columns, dict) else columns,
+             digests.get((year, datafile)), aggregate.get(datafile), batch_size, float32, scl_profile.enabled)
+            for year, datafile in items]
+    if pool is not None or (workers > 1 and len(args) > 1):
+        own_pool = pool is None
+        if own_pool:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(args)))
+        try:
+            depth = max(prefetch_depth, workers)
+            for item, (df, records) in zip(items, prefetch(pool, load_item, args, depth)):
+                scl_profile.records.extend(records)
+                yield item, df
+        finally:
+            if own_pool:
+                pool.shutdown()
+    elif prefetch_depth > 0 and len(args) > 1:
+        with ThreadPoolExecutor(max_workers=prefetch_depth) as threads:
+            yield from zip(items, prefetch(threads, load_args, args, prefetch_depth))
+    else:
+        for item, a in zip(items, args):
+            yield item, load_args(a)
+
+
+# load the attribute columns for a list of (year, datafile) pairs all at once, as a dictionary of (year, datafile) -> df
+# (see iter_many for the arguments); workers = 1 and no pool loads serially in this process
+def load_many(scl_dir, items, columns=None, workers=1, digests=None, aggregate=None, batch_size=default_batch_size, pool=None, float32=False):
+    return dict(iter_many(scl_dir, items, columns, workers, digests, aggregate, batch_size, pool, prefetch_depth=0, float32=float32))
@@ -0,0 +1,346 @@
+# scl_engine.py
+
+# Goal:  run any set of the SCL website reports from a single pass over the SCL pipeline outputs
+#
+# each report script registers the columns it needs from each datafile along with a build function (loaded frames -> result)
+# and a write function (result -> csv in the output folder, scl_dir unless given another)
+# the engine takes the union of the columns every selected report asks for, reads each (year, datafile) exactly once
+# and then hands every report just the columns it registered
+#
+# years default to every timepoint subfolder found in scl_dir, and all the inputs are checked up front
+# so a missing file stops the run before anything is read
+#
+# reports can declare plans (see scl_plan.py) instead of working on the raw frames: the columns, group keys and
+# derived ratios they want from each datafile; the engine then collects the plans of every report for a timepoint
+# together, so each datafile is grouped once per set of keys for all of them, and hands each report its finished plan results
+#
+# the inputs are read in order, a year at a time, with the next --prefetch inputs read in background threads (or worker
+# processes with --workers) while the current year's plans run, so reading and aggregating overlap; each year's raw frames
+# are dropped once its plans have run, so memory is bounded by the inputs in flight rather than by the whole run
+#
+# with --chunk-size, datafiles whose reports only ever sum their values by some group keys are read in batches
+# and summed by those keys as they stream in (see scl_data.aggregate_attributes), so memory depends on the
+# number of distinct keys rather than features; a report registers those keys, and reports that need the raw
+# rows (the by-biome report's ecoregions) keep their datafiles loaded whole
+# the keys a datafile is summed by depend on which reports are run, so they're recorded with the stored results
+#
+# with a store (see scl_store.py) the inputs are read from its parquet partitions instead of the geojsons,
+# and scl_dir is only where the reports and the manifest are written
+# plans that only sum by lsid, country or biome are then rolled up from the store's aggregate index (see scl_index.py),
+# and datafiles whose plans are all answered that way aren't read at all
+#
+# landscape tables (results with a name column) get their names from the landscape names registry (see scl_names.py),
+# read from --names or landscape_names.csv in scl_dir; landscapes it doesn't name are listed in unnamed_landscapes.csv
+#
+# reports registered as incremental build one independent result per year (the trend tables)
+# their per-year results are kept in the scl_data manifest along with the hashes of the inputs they came from
+# (dataframe results, e.g. the per-lsid sums of the change report, go to a parquet file in the cache and the manifest
+# only points at it)
+# and the load options (--float32, --chunk-size) they were built with, so a rerun only loads and recomputes the years
+# whose inputs are new or changed, or that were built with other options, and merges them with the stored ones
+
+# imports
+import os
+import json
+import hashlib
+import argparse
+import collections
+import pandas as pd
+import scl_data
+import scl_plan
+import scl_index
+import scl_store
+import scl_names
+import scl_output
+import scl_profile
+
+
+# Set up
+
+# registered reports, by name
+reports = {}
+
+
+# register a report
+# inputs is a dictionary of datafile -> list of attribute columns the report reads from it
+# build(dfs, years) gets a dictionary of (year, datafile) -> dataframe and returns the report's result
+# write(result, out_dir, years) writes that result out into out_dir
+# incremental = True means the result is a dictionary of year -> json-serializable values computed from that year alone,
+# or year -> dataframe for results too big for the manifest (kept as parquet in the cache, see store_result)
+# keys are the group keys the report's build only ever sums by (e.g. ['lsid']), so it gives the same result when handed
+# rows already summed by those keys; keys = None means the report needs the individual rows
+# plans is an optional dictionary of plan name -> scl_plan.Plan; the report's inputs are then taken from the plans
+# and build gets a dictionary of (year, plan name) -> plan result instead of the raw frames
+# table(result, years) optionally turns the result of every year (for incremental reports, the stored years merged
+# with the new ones) into the table that's named and written, for reports that compare years with each other
+def register(name, inputs, build, write, incremental=False, keys=None, plans=None, table=None):
+    if plans is not None:
+        inputs = scl_plan.inputs(plans.values())
+    reports[name] = {'inputs': inputs, 'build': build, 'write': write, 'incremental': incremental, 'keys': keys, 'plans': plans,
+                     'table': table}
+
+
+# union of the columns needed from each datafile by the given reports, keeping first-seen order
+def merge_inputs(names):
+    merged = {}
+    for name in names:
+        for datafile, columns in reports[name]['inputs'].items():
+            merged.setdefault(datafile, [])
+            merged[datafile] += [col for col in columns if col not in merged[datafile]]
+    return merged
+
+
+# group keys to pre-aggregate each datafile by when reading in chunks: the union of the keys of every report reading it,
+# leaving out any datafile read by a report that needs the individual rows
+def merge_keys(names):
+    merged = {}
+    for name in names:
+        for datafile in reports[name]['inputs']:
+            if reports[name]['keys'] is None or merged.get(datafile, []) is None:
+                merged[datafile] = None
+            else:
+                merged.setdefault(datafile, [])
+                merged[datafile] += [key for key in reports[name]['keys'] if key not in merged[datafile]]
+    return {datafile: keys for datafile, keys in merged.items() if keys is not None}
+
+
+# the load options an incremental report's results depend on besides its inputs: float32 areas, and the keys and
+# batch size its datafiles were summed by in chunks (both change the sums in the last digits)
+def load_options(name, float32, aggregate, chunk_size):
+    chunked = {datafile: sorted(aggregate[datafile]) for datafile in reports[name]['inputs'] if datafile in (aggregate or {})}
+    return {'float32': float32, 'chunked': chunked, 'chunk_size': chunk_size if chunked else None}
+
+
+# years whose stored result for an incremental report is still valid, i.e. was built from the current inputs
+# with the same load options (and its parquet file, if it has one, is still there); results stored without options
+# are from before they were recorded and are rebuilt
+def cached_years(scl_dir, name, years, digests, manifest, options):
+    stored = manifest['reports'].get(name, {})
+    cached = []
+    for year in years:
+        current = {datafile: digests[(year, datafile)] for datafile in reports[name]['inputs']}
+        if (year in stored and stored[year]['inputs'] == current and stored[year].get('options') == options
+                and ('file' not in stored[year] or os.path.exists(os.path.join(scl_dir, stored[year]['file'])))):
+            cached.append(year)
+    return cached
+
+
+# the manifest entry of one year's result of an incremental report
+# a dataframe result is written to a parquet file in the cache, keyed by the inputs and options it came from,
+# and the entry only records its path (relative to scl_dir); anything else is kept in the entry itself
+def store_result(scl_dir, name, year, inputs, options, result):
+    entry = {'inputs': inputs, 'options': options}
+    if isinstance(result, pd.DataFrame):
+        key = hashlib.sha1(json.dumps([inputs, options], sort_keys=True).encode('utf-8')).hexdigest()
+        path = scl_data.result_path(scl_dir, year, name, key)
+        scl_data.write_cache(result, path)
+        entry['file'] = os.path.relpath(path, scl_dir)
+    else:
+        entry['result'] = result
+    return entry
+
+
+# the result recorded in a manifest entry by store_result
+def stored_result(scl_dir, entry):
+    if 'file' in entry:
+        return pd.read_parquet(os.path.join(scl_dir, entry['file']))
+    return entry['result']
+
+
+# run the plans of every report that still needs a year, all together so shared groupings run once, and roll the ones
+# the store's aggregate index can answer up from it; returns a dictionary of (year, report, plan name) -> plan result
+def collect_plans(year, names, todo, dfs, lookups, store):
+    plan_results = {}
+    plans = {(name, plan_name): plan for name in names if reports[name]['plans'] and year in todo[name]
+             for plan_name, plan in reports[name]['plans'].items()}
+    looked_up = {key: plan for key, plan in plans.items() if (year,) + key in lookups}
+    plans = {key: plan for key, plan in plans.items() if key not in looked_up}
+    if plans:
+        with scl_profile.phase('plan', year=year) as p:
+            frames = {datafile: dfs[(year, datafile)] for datafile in scl_plan.inputs(plans.values())}
+            plan_results.update({(year,) + key: df for key, df in scl_plan.collect_all(plans, frames).items()})
+            p['rows'] = sum(len(df) for df in frames.values())
+    if looked_up:
+        with scl_profile.phase('index_lookup', year=year) as p:
+            tables = {}
+            for key, plan in looked_up.items():
+                table = (plan.datafile, lookups[(year,) + key])
+                if table not in tables:
+                    tables[table] = scl_index.read(store, table[1], year, table[0])
+                plan_results[(year,) + key] = scl_index.collect(plan, tables[table])
+            p['rows'] = sum(len(df) for df in tables.values())
+    return plan_results
+
+
+# load every input of the given reports once, then build and write each report in turn
+# years = None runs every timepoint found in scl_dir (or in the store)
+# rebuild = True ignores the stored per-year results of incremental reports
+# store is an optional scl_store folder to read the inputs from
+# chunk_size = None loads inputs whole, otherwise summable inputs are aggregated in batches of that many features
+# out_dir is where the reports are written (default scl_dir); the manifest always stays with the inputs in scl_dir
+# pool is an optional executor shared between several runs (see scl_batch.py) that the loads are spread over
+# names_path is the landscape names file (default landscape_names.csv in scl_dir, if there is one)
+# prefetch is the number of inputs read ahead in background threads while the current one is worked on (0 = none)
+# float32 = True downcasts the loaded area columns to halve their memory (see scl_data.compact)
+def run(scl_dir, years, names, workers=1, rebuild=False, store=None, chunk_size=None, out_dir=None, pool=None, names_path=None,
+        prefetch=scl_data.default_prefetch, float32=False):
+    source = scl_dir if store is None else store
+    found = scl_data.discover(scl_dir) if store is None else scl_store.discover(store)
+    if years is None:
+        years = list(found)
+        if not years:
+            raise FileNotFoundError('no timepoints found in ' + source)
+    inputs = merge_inputs(names)
+    items = [(year, datafile) for year in years for datafile in inputs]
+
+    # make sure every input is there before starting
+    missing = scl_data.missing_inputs(found, items)
+    if missing:
+        raise FileNotFoundError('missing SCL inputs in ' + source + ': ' + ', '.join(year + '/' + datafile for year, datafile in missing))
+
+    # hash the inputs (re-using the manifest for files that haven't changed) to see which years need computing
+    # a store already knows the hashes of the geojsons it was built from
+    manifest = scl_data.read_manifest(scl_dir)
+    if store is None:
+        digests = {(year, datafile): scl_data.file_digest(scl_dir, year, datafile, manifest) for year, datafile in items}
+    else:
+        digests = scl_store.digests(store)
+    aggregate = merge_keys(names) if chunk_size else None
+    options = {name: load_options(name, float32, aggregate, chunk_size) for name in names}
+    todo = {}
+    for name in names:
+        if reports[name]['incremental'] and not rebuild:
+            cached = cached_years(scl_dir, name, years, digests, manifest, options[name])
+            todo[name] = [year for year in years if year not in cached]
+        else:
+            todo[name] = list(years)
+
+    # with a store, find the plans its aggregate index can answer, as (year, report, plan name) -> index table
+    lookups = {}
+    if store is not None:
+        indexed = scl_index.available(store)
+        for name in names:
+            for plan_name, plan in (reports[name]['plans'] or {}).items():
+                table = scl_index.match(plan)
+                for year in todo[name]:
+                    if table in indexed.get((year, plan.datafile), []):
+                        lookups[(year, name, plan_name)] = table
+
+    # load only what some report still has to compute from the raw features
+    needed = [(year, datafile) for year, datafile in items
+              if any(year in todo[name] and datafile in reports[name]['inputs']
+                     and (reports[name]['plans'] is None
+                          or any(plan.datafile == datafile and (year, name, plan_name) not in lookups
+                                 for plan_name, plan in reports[name]['plans'].items()))
+                     for name in names)]
+    if store is None:
+        loader = scl_data.iter_many(scl_dir, needed, columns=inputs, workers=workers, digests=digests, aggregate=aggregate,
+                                    batch_size=chunk_size or scl_data.default_batch_size, pool=pool, prefetch_depth=prefetch, float32=float32)
+    else:
+        loader = scl_store.iter_many(store, needed, columns=inputs, aggregate=aggregate,
+                                     batch_size=chunk_size or scl_data.default_batch_size, prefetch_depth=prefetch, float32=float32)
+
+    # collect each year's plans as soon as its last input arrives, while the next inputs are read in the background,
+    # then let go of its frames unless a report without plans still needs them
+    kept = {datafile for name in names if reports[name]['plans'] is None for datafile in reports[name]['inputs']}
+    remaining = collections.Counter(year for year, datafile in needed)
+    dfs = {}
+    plan_results = {}
+    for (year, datafile), df in loader:
+        dfs[(year, datafile)] = df
+        remaining[year] -= 1
+        if remaining[year] == 0:
+            plan_results.update(collect_plans(year, names, todo, dfs, lookups, store))
+            for item in [item for item in dfs if item[0] == year and item[1] not in kept]:
+                del dfs[item]
+    # years read entirely from the index, or not at all
+    for year in years:
+        if year not in remaining:
+            plan_results.update(collect_plans(year, names, todo, dfs, lookups, store))
+
+    # the landscape names, loaded once for every report
+    if names_path is None and os.path.exists(os.path.join(scl_dir, scl_names.names_file)):
+        names_path = os.path.join(scl_dir, scl_names.names_file)
+    registry = scl_names.load(names_path) if names_path is not None else None
+    unnamed = []
+
+    out_dir = out_dir or scl_dir
+    os.makedirs(out_dir, exist_ok=True)
+    for name in names:
+        report = reports[name]
+        if report['plans'] is None:
+            report_dfs = {(year, datafile): dfs[(year, datafile)][columns]
+                          for year in todo[name] for datafile, columns in report['inputs'].items()}
+        else:
+            report_dfs = {(year, plan_name): plan_results[(year, name, plan_name)]
+                          for year in todo[name] for plan_name in report['plans']}
+        with scl_profile.phase('build', report=name) as p:
+            result = report['build'](report_dfs, todo[name])
+            p['rows'] = sum(len(df) for df in report_dfs.values())
+
+        if report['incremental']:
+            # merge the new years with the stored ones and remember the new ones for next time
+            stored = manifest['reports'].setdefault(name, {})
+            for year in todo[name]:
+                stored[year] = store_result(scl_dir, name, year, {datafile: digests[(year, datafile)] for datafile in report['inputs']},
+                                            options[name], result[year])
+            result = {year: result[year] if year in todo[name] else stored_result(scl_dir, stored[year]) for year in years}
+
+        if report['table'] is not None:
+            with scl_profile.phase('table', report=name) as p:
+                result = report['table'](result, years)
+                p['rows'] = len(result)
+
+        if registry is not None and isinstance(result, pd.DataFrame) and 'name' in result.columns:
+            with scl_profile.phase('name_join', report=name) as p:
+                result, missing = scl_names.join(registry, result)
+                p['rows'] = len(result)
+            if len(missing):
+                print (len(missing), "rows of", name, "have no landscape name")
+                unnamed.append(missing.assign(report=name))
+
+        with scl_profile.phase('csv_write', report=name):
+            report['write'](result, out_dir, years)
+
+    if unnamed:
+        unnamed = pd.concat(unnamed)[['report','date','lstype','lsid']].drop_duplicates()
+        scl_output.write_table(unnamed, out_dir, 'unnamed_landscapes.csv', ['Report','Analysis date','Landscape type','Lsid'])
+
+    scl_data.write_manifest(scl_dir, manifest)
+
+
+# command line entry point shared by scl_reports.py and the individual report scripts
+# names are the reports to run by default; scl_dir and years are the defaults for --scl-dir and --years
+# years = None means every timepoint found in scl_dir
+def main(names, scl_dir, years=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scl-dir', default=scl_dir, help='folder holding the SCL outputs organized by timepoint')
+    parser.add_argument('--out-dir', default=None, help='folder the reports are written to (default: scl_dir)')
+    parser.add_argument('--years', nargs='+', default=years, help='timepoints (subfolder names) to report on (default: every timepoint found in scl_dir)')
+    parser.add_argument('--reports', nargs='+', default=names, choices=sorted(reports), help='reports to produce')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes used to load the geojson files (1 = serial)')
+    parser.add_argument('--prefetch', type=int, default=scl_data.default_prefetch, metavar='N',
+                        help='inputs read ahead in background threads while the current one is aggregated (default %(default)s, 0 = none); bounds memory to N inputs')
+    parser.add_argument('--float32', action='store_true', help='hold the loaded area columns as float32 instead of float64 (sums may differ in the last digits)')
+    parser.add_argument('--store', default=None, help='read the inputs from this scl_store folder (see scl_store.py) instead of the geojsons in scl_dir')
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='N',
+                        help='sum large inputs by landscape (and country) in batches of N features instead of loading them whole')
+    parser.add_argument('--names', default=None, help='landscape names csv (default: landscape_names.csv in scl_dir, if there is one)')
+    parser.add_argument('--formats', nargs='+', default=['csv'], choices=scl_output.all_formats, help='output formats for every table (default csv)')
+    parser.add_argument('--no-atomic', action='store_true', help='write the tables in place instead of renaming complete files into place')
+    parser.add_argument('--rebuild', action='store_true', help='recompute every year instead of re-using stored results for unchanged inputs')
+    parser.add_argument('--profile', nargs='?', const='scl_profile.json', default=None, metavar='TRACE',
+                        help='record time, rows, bytes read and peak memory of every phase, print a summary and write a json trace (default scl_profile.json)')
+    args = parser.parse_args()
+
+    scl_profile.enable(args.profile is not None)
+    scl_output.configure(args.formats, not args.no_atomic)
+
+    try:
+        run(args.scl_dir, args.years, args.reports, workers=args.workers, rebuild=args.rebuild, store=args.store, chunk_size=args.chunk_size, out_dir=args.out_dir, names_path=args.names, prefetch=args.prefetch, float32=args.float32)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    if args.profile is not None:
+        scl_profile.print_summary()
+        scl_profile.write_trace(args.profile)
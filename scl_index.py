@@ -0,0 +1,113 @@
+# scl_index.py
+
+# Goal:  a persistent per-(year, landscape type, lsid) aggregate index that the landscape-level tables are looked up in
+#
+# the landscape geojsons are split by state/province boundaries, so every landscape report starts by summing the
+# polygons back up by lsid; the index does that once, when a release is ingested into a store (see scl_store.py),
+# and keeps the results next to the attributes as three tables, hive-partitioned like them:
+#     <store>/index/landscapes/year=2020-01-01/lstype=scl_species/part-0.parquet    area columns summed by lsid
+#     <store>/index/countries/...                                                   area columns summed by lsid and country
+#     <store>/index/biomes/...                                                      eff_pot_hab_area of the ecoregions summed by lsid and biome
+# rows with a missing key are kept, so totals over a whole datafile still add up to the sum of every feature
+#
+# when the engine reads from a store, any report plan (see scl_plan.py) that only sums by keys one of the tables is
+# grouped by is rolled up from the table instead of the raw features, so the landscape list, by-admin and by-biome
+# tables (and the trend totals) don't re-read or regroup the features at all
+# scl_store.lookup reads the tables across years and landscape types by lsid, e.g. for the website
+#
+# which partitions are indexed, and from which source hash, is recorded in <store>/index.json
+
+# imports
+import os
+import pandas as pd
+import scl_data
+import scl_plan
+
+
+# Set up
+
+# subfolder of the store holding the index tables
+index_subdir = "index"
+# record of the indexed partitions
+index_file = "index.json"
+# the tables and the keys each one is summed by
+tables = {'landscapes': ['lsid'], 'countries': ['lsid','country'], 'biomes': ['lsid','biome_name']}
+# the json list column the biome table is exploded from, and the fields of each of its items
+ecoregions_column = 'ecoregions'
+ecoregion_fields = ['biome_name','eff_pot_hab_area']
+
+
+# path of one index table partition
+def index_path(store_dir, table, year, datafile):
+    return os.path.join(store_dir, index_subdir, table, 'year=' + year, 'lstype=' + os.path.splitext(datafile)[0], 'part-0.parquet')
+
+
+# the indexed partitions, as a dictionary of 'year/datafile' -> {'source': hash, 'tables': [table, ...]}
+def read_index(store_dir):
+    return scl_data.read_json(os.path.join(store_dir, index_file), {})
+
+
+# record the indexed partitions (see scl_data.write_json)
+def write_index(store_dir, indexed):
+    scl_data.write_json(os.path.join(store_dir, index_file), indexed)
+
+
+# the tables available for each (year, datafile) in a store
+def available(store_dir):
+    return {tuple(key.split('/')): entry['tables'] for key, entry in read_index(store_dir).items()}
+
+
+# the index tables of one datafile's attributes, as a dictionary of table -> frame indexed by the table's keys
+# datafiles without an lsid column (e.g. scl_states) get no tables, and the biome table needs the ecoregions column
+def build(df):
+    if 'lsid' not in df.columns:
+        return {}
+    areas = [col for col in df.columns if col.endswith('_area')]
+    built = {'landscapes': scl_plan.group_sum(df, ['lsid'], areas, dropna=False)}
+    if 'country' in df.columns:
+        built['countries'] = scl_plan.group_sum(df, ['lsid','country'], areas, dropna=False)
+    if ecoregions_column in df.columns:
+        ecoregions = scl_plan.explode_json(df, ecoregions_column, ecoregion_fields, carry=['lsid'])
+        built['biomes'] = scl_plan.group_sum(ecoregions, tables['biomes'], ['eff_pot_hab_area'], dropna=False)
+    return built
+
+
+# build and write the index tables of one (year, datafile); returns the names of the tables written
+def write(store_dir, year, datafile, df):
+    built = build(df)
+    for table, table_df in built.items():
+        scl_data.write_cache(table_df.reset_index(), index_path(store_dir, table, year, datafile))
+    return list(built)
+
+
+# read one index table partition, indexed by its keys
+def read(store_dir, table, year, datafile):
+    return pd.read_parquet(index_path(store_dir, table, year, datafile)).set_index(tables[table])
+
+
+# the index table a plan can be rolled up from, or None if it needs the raw features
+# that's a plan starting with a group_sum of area columns by keys the table is grouped by, or exploding the
+# ecoregions and then summing their eff_pot_hab_area by lsid and/or biome
+def match(plan):
+    op, args = plan.steps[0]
+    if op == 'group_sum':
+        if all(value.endswith('_area') for value in args['values']):
+            for table in ('landscapes', 'countries'):
+                if set(args['keys']) <= set(tables[table]):
+                    return table
+        return None
+    if op == 'explode_json' and len(plan.steps) > 1 and plan.steps[1][0] == 'group_sum':
+        group = plan.steps[1][1]
+        if (args['column'] == ecoregions_column and set(args['carry']) <= {'lsid'}
+                and set(group['keys']) <= set(tables['biomes']) and set(group['values']) <= set(args['fields']) - {'biome_name'}
+                and set(args['fields']) <= set(ecoregion_fields)):
+            return 'biomes'
+    return None
+
+
+# run a plan from the index table match() picked for it instead of from the raw features
+def collect(plan, table_df):
+    steps = plan.steps[1:] if plan.steps[0][0] == 'group_sum' else plan.steps[2:]
+    group = plan.steps[0][1] if plan.steps[0][0] == 'group_sum' else plan.steps[1][1]
+    df = scl_plan.group_sum(table_df, group['keys'], group['values'])
+    return scl_plan.run_steps(df, steps, plan.datafile)
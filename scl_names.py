@@ -0,0 +1,92 @@
+# scl_names.py
+
+# Goal:  give the landscapes their names, from a separate file keyed by year, landscape type and lsid
+#
+# the names file is a csv with an lsid and a name column, and optionally year and lstype columns when names differ
+# between timepoints or landscape types, e.g.
+#     year,lstype,lsid,name
+#     2020,species,00000000000000000001_00000000000000000010,Terai Arc
+# year can be a year or a timepoint date, and lstype a landscape type (species fragment) or a datafile (scl_species_fragment)
+#
+# the file is read once into a registry: a series of names indexed by (year, lstype, lsid), kept in a parquet cache
+# next to it (keyed by the hash of the file, like the attribute cache) so later runs don't re-parse the csv
+# join() looks up the names of every row of a landscape table in one vectorized reindex, and the engine applies it
+# to every landscape table it builds; landscapes without a name keep the "tbd" placeholder and are reported
+
+# imports
+import os
+import numpy as np
+import pandas as pd
+import scl_data
+
+
+# Set up
+
+# default names file, looked for in scl_dir
+names_file = "landscape_names.csv"
+# placeholder name of landscapes the registry doesn't have
+unnamed = "tbd"
+# the keys of the registry
+keys = ['year','lstype','lsid']
+# registries already loaded in this process, by names file content hash
+loaded = {}
+
+
+# year of a timepoint or a year, as a string (2020-01-01 -> 2020)
+def normalize_years(values):
+    return pd.Series(values, dtype=str).str[:4].to_numpy()
+
+
+# landscape type of a datafile or a landscape type (scl_species_fragment.geojson -> species fragment)
+def normalize_lstypes(values):
+    return (pd.Series(values, dtype=str).str.replace(r'\.geojson$', '', regex=True)
+                                        .str.replace(r'^scl_', '', regex=True)
+                                        .str.replace('_', ' ').to_numpy())
+
+
+# read and index a names csv; keys the file doesn't have (year or lstype) are stored as ''
+def read_names(path):
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = [col for col in ['lsid','name'] if col not in df.columns]
+    if missing:
+        raise ValueError(path + ' has no ' + ' or '.join(missing) + ' column')
+    df['year'] = normalize_years(df['year']) if 'year' in df.columns else ''
+    df['lstype'] = normalize_lstypes(df['lstype']) if 'lstype' in df.columns else ''
+    df = df.drop_duplicates(keys, keep='last')
+    return df.set_index(keys)['name'].astype('category').sort_index()
+
+
+# load the registry for a names file, from its parquet cache if the file hasn't changed
+def load(path):
+    digest = scl_data.file_hash(path)
+    if digest not in loaded:
+        cache = os.path.join(os.path.dirname(path), scl_data.cache_subdir, 'names',
+                             os.path.splitext(os.path.basename(path))[0] + '_' + digest[:16] + '.parquet')
+        if os.path.exists(cache):
+            registry = pd.read_parquet(cache).set_index(keys)['name'].astype('category')
+        else:
+            registry = read_names(path)
+            scl_data.write_cache(registry.reset_index(), cache)
+        loaded[digest] = registry
+    return loaded[digest]
+
+
+# the names of the landscapes in a table with date, lstype and lsid columns, as an array; unnamed ones are NaN
+# a registry from a file without a year (or lstype) column names a landscape the same in every year (or type)
+def lookup(registry, df):
+    years = normalize_years(df['date'])
+    lstypes = normalize_lstypes(df['lstype'])
+    if (registry.index.get_level_values('year') == '').all():
+        years = np.full(len(df), '')
+    if (registry.index.get_level_values('lstype') == '').all():
+        lstypes = np.full(len(df), '')
+    index = pd.MultiIndex.from_arrays([years, lstypes, df['lsid'].astype(str).to_numpy()], names=keys)
+    return registry.reindex(index).astype(object).to_numpy()
+
+
+# fill in the name column of a landscape table from the registry; returns the table and the rows that had no name
+def join(registry, df):
+    names = lookup(registry, df)
+    named = pd.notna(names)
+    df['name'] = pd.Series(names, index=df.index).where(named, unnamed)
+    return df, df.loc[~named, ['date','lstype','lsid']]
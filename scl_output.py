@@ -0,0 +1,73 @@
+# scl_output.py
+
+# Goal:  one place that writes the report tables to disk, in every output format asked for
+#
+# each report hands write_table its finished table (a dataframe), the name of its csv file and the header labels,
+# and the table is written in a single buffered pass instead of a header and then appended rows
+# with atomic writes (the default) every file goes to a temporary name first and is renamed into place once complete,
+# so a crashed run never leaves a half-written table for the website to pick up
+#
+# formats (--formats):  csv (the default), csv.gz, parquet and xlsx, all written from the same in-memory table
+# xlsx puts the table on a sheet named after the report, like the SCL_Panthera_tigris_range workbook, and needs openpyxl
+
+# imports
+import os
+
+
+# Set up
+
+# formats every table is written in, with their file extensions
+formats = ['csv']
+all_formats = ['csv', 'csv.gz', 'parquet', 'xlsx']
+# write each file under a temporary name and rename it into place when it's complete
+atomic = True
+# longest sheet name excel allows
+max_sheet_name = 31
+
+
+# choose the output formats for the rest of the run and whether files are renamed into place
+def configure(fmts=None, atomic_write=True):
+    global formats, atomic
+    unknown = [fmt for fmt in fmts or [] if fmt not in all_formats]
+    if unknown:
+        raise ValueError('unknown output format ' + ', '.join(unknown) + ' (choose from ' + ', '.join(all_formats) + ')')
+    formats = list(fmts or ['csv'])
+    atomic = atomic_write
+
+
+# one writer per format; compression and the excel engine are given explicitly rather than guessed from the path
+def write_csv(df, path, header, title):
+    df.to_csv(path, header=header, index=False, encoding='utf-8', compression=None)
+
+
+def write_csv_gz(df, path, header, title):
+    df.to_csv(path, header=header, index=False, encoding='utf-8', compression='gzip')
+
+
+def write_parquet(df, path, header, title):
+    df.set_axis(header, axis=1).to_parquet(path, index=False)
+
+
+def write_xlsx(df, path, header, title):
+    df.to_excel(path, header=header, index=False, sheet_name=title[:max_sheet_name], engine='openpyxl')
+
+
+writers = {'csv': write_csv, 'csv.gz': write_csv_gz, 'parquet': write_parquet, 'xlsx': write_xlsx}
+
+
+# write one report table in every configured format, as <out_dir>/<csv_file without .csv>.<format>
+# header is the list of labels for the columns of df, title names the sheet in xlsx output (default the file name)
+def write_table(df, out_dir, csv_file, header, title=None):
+    stem = os.path.splitext(csv_file)[0]
+    for fmt in formats:
+        path = os.path.join(out_dir, stem + '.' + fmt)
+        # the temporary name keeps the extension, which the excel writer checks
+        tmp_path = os.path.join(out_dir, stem + '.tmp' + str(os.getpid()) + '.' + fmt) if atomic else path
+        try:
+            writers[fmt](df, tmp_path, list(header), title or stem)
+        except BaseException:
+            if atomic and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if atomic:
+            os.replace(tmp_path, path)
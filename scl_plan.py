@@ -0,0 +1,160 @@
+# scl_plan.py
+
+# Goal:  let the reports declare what they compute from each datafile instead of running their own pandas pipelines
+#
+# a plan is a lazy description of the steps a report wants from one datafile, e.g. the by-admin table is
+#     Plan('scl_species.geojson').group_sum(['lsid','country'], ['eff_pot_hab_area'])
+#                                .share('ls_frac', 'eff_pot_hab_area', within=['lsid'])
+#                                .pivot('country', 'ls_frac')
+# nothing runs until the engine collects the plans of every report for a year (collect_all), which
+#   - reads only the columns the plans touch (columns())
+#   - fuses the plans on the same datafile that start with a group_sum by the same keys into one groupby over the union
+#     of their values, so e.g. the landscape list and the trend tables group scl_species.geojson by lsid once
+#     plans with different keys are each grouped straight from the raw frame rather than rolled up from a groupby over
+#     the union of the keys, so a table's sums (to the last digit) don't depend on which other reports are in the run
+#   - runs the remaining steps on the small grouped frames, without the intermediate copies of the old
+#     pivot / groupby / merge / drop / pivot chains
+#
+# steps:
+#   explode_json(column, fields, carry)   one row per item of a json list column (e.g. ecoregions), carrying some columns along
+#   group_sum(keys, values)               sum values by keys; the result is indexed by keys (keys = [] gives one row of totals)
+#   ratio(name, numerator, denominator)   new column numerator / denominator (e.g. kba_frac)
+#   share(name, value, within)            new column value / total of value within some of the keys (e.g. ls_frac)
+#   pivot(column, value)                  spread one of the keys into columns of value, filling gaps with 0
+
+# imports
+import json
+import itertools
+import numpy as np
+import pandas as pd
+import scl_profile
+
+
+# a lazy sequence of steps over one datafile; every step returns a new plan so plans can be shared and extended
+class Plan:
+
+    def __init__(self, datafile, steps=()):
+        self.datafile = datafile
+        self.steps = list(steps)
+
+    def then(self, op, **args):
+        return Plan(self.datafile, self.steps + [(op, args)])
+
+    def explode_json(self, column, fields, carry=()):
+        return self.then('explode_json', column=column, fields=list(fields), carry=list(carry))
+
+    def group_sum(self, keys, values):
+        return self.then('group_sum', keys=list(keys), values=list(values))
+
+    def ratio(self, name, numerator, denominator):
+        return self.then('ratio', name=name, numerator=numerator, denominator=denominator)
+
+    def share(self, name, value, within):
+        return self.then('share', name=name, value=value, within=list(within))
+
+    def pivot(self, column, value, fill_value=0):
+        return self.then('pivot', column=column, value=value, fill_value=fill_value)
+
+    # the columns of the datafile this plan reads, i.e. its projection
+    def columns(self):
+        op, args = self.steps[0]
+        if op == 'explode_json':
+            return args['carry'] + [args['column']]
+        if op == 'group_sum':
+            return args['keys'] + args['values']
+        raise ValueError('a plan has to start with explode_json or group_sum, not ' + op)
+
+    # whether the plan starts with a group_sum that can be fused with other plans on the same datafile
+    def fusable(self):
+        return bool(self.steps) and self.steps[0][0] == 'group_sum'
+
+
+# the datafile columns read by a set of plans, as a dictionary of datafile -> columns (first-seen order)
+def inputs(plans):
+    merged = {}
+    for plan in plans:
+        merged.setdefault(plan.datafile, [])
+        merged[plan.datafile] += [col for col in plan.columns() if col not in merged[plan.datafile]]
+    return merged
+
+
+# one row per item of the json lists in column; all the lists are parsed in a single json.loads call
+def explode_json(df, column, fields, carry):
+    parsed = json.loads('[' + ','.join(df[column]) + ']')
+    long_df = pd.DataFrame.from_records(itertools.chain.from_iterable(parsed), columns=fields)
+    counts = [len(items) for items in parsed]
+    for col in carry:
+        long_df[col] = np.repeat(df[col].to_numpy(), counts)
+    return long_df
+
+
+# sum values by keys; keys = [] gives a one row frame of totals
+# dropna = False keeps rows with a missing key, for the index tables (see scl_index.py) that plans roll up from
+def group_sum(df, keys, values, dropna=True):
+    if not keys:
+        return df[values].sum().to_frame().T
+    # observed = True so categorical keys only give the combinations that occur
+    if isinstance(df.index, pd.MultiIndex) or df.index.name is not None:
+        return df.groupby(level=keys, observed=True)[values].sum()
+    return df.groupby(keys, dropna=dropna, observed=True)[values].sum()
+
+
+# run one step of a plan
+def apply_step(df, op, args):
+    if op == 'explode_json':
+        return explode_json(df, **args)
+    if op == 'group_sum':
+        return group_sum(df, args['keys'], args['values'])
+    if op == 'ratio':
+        df[args['name']] = df[args['numerator']] / df[args['denominator']]
+        return df
+    if op == 'share':
+        df[args['name']] = df[args['value']] / df.groupby(level=args['within'])[args['value']].transform('sum')
+        return df
+    if op == 'pivot':
+        # like pivot_table with aggfunc sum, undefined values (e.g. a share of a zero total) come out as fill_value too
+        spread = df[args['value']].unstack(args['column'], fill_value=args['fill_value']).fillna(args['fill_value'])
+        spread.columns.name = None
+        return spread
+    raise ValueError('unknown plan step ' + op)
+
+
+# run the given steps of a plan on df, one profiled phase per step
+def run_steps(df, steps, datafile):
+    for op, args in steps:
+        with scl_profile.phase(op, datafile=datafile) as p:
+            p['rows'] = len(df)
+            df = apply_step(df, op, args)
+    return df
+
+
+# run a set of plans against the loaded frames of one timepoint
+# plans is a dictionary of any key -> Plan, frames a dictionary of datafile -> dataframe; returns key -> result
+def collect_all(plans, frames):
+    results = {}
+
+    # fuse the plans that start with group_sum: one groupby per datafile and keys over the union of their values
+    # every value column is summed on its own, so each plan gets the same sums as if it had been grouped alone
+    fused = {}
+    for key, plan in plans.items():
+        if plan.fusable():
+            fused.setdefault((plan.datafile, tuple(plan.steps[0][1]['keys'])), []).append(key)
+    bases = {}
+    for (datafile, group_keys), keys in fused.items():
+        base_values = list(dict.fromkeys(itertools.chain.from_iterable(plans[key].steps[0][1]['values'] for key in keys)))
+        with scl_profile.phase('group_sum', datafile=datafile) as p:
+            bases[(datafile, group_keys)] = group_sum(frames[datafile], list(group_keys), base_values)
+            p['rows'] = len(frames[datafile])
+
+    for key, plan in plans.items():
+        if plan.fusable():
+            # take the plan's values from the fused groupby, then carry on with the rest of the plan
+            args = plan.steps[0][1]
+            df = bases[(plan.datafile, tuple(args['keys']))][args['values']].copy()
+            steps = plan.steps[1:]
+        else:
+            df = frames[plan.datafile]
+            steps = plan.steps
+        results[key] = run_steps(df, steps, plan.datafile)
+
+    return results
@@ -0,0 +1,126 @@
+# scl_profile.py
+
+# Goal:  phase-level timing and memory instrumentation for the SCL reports, turned on with --profile
+#
+# code wraps each phase (geojson parse, cache read, pivot_table, merge, json parsing, csv write, ...) in
+#     with scl_profile.phase('pivot_table', year=year, datafile=datafile) as p:
+#         ...
+#         p['rows'] = len(df)
+# and every phase records its wall time, rows processed, bytes read, the resident memory (RSS) of the process when it
+# started and finished and the growth between the two, plus the peak RSS of the process so far
+# the peak is the process's high-water mark, so it only ever goes up from one phase to the next; the growth is what
+# a phase itself held on to (phases running at the same time in other threads are counted in each other's growth)
+# when profiling is off, phase() does nothing beyond handing back a scratch dictionary
+#
+# the engine prints a summary table by phase at the end of the run and writes the individual records as a json trace
+
+# imports
+import os
+import json
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # not available on windows, where psutil is used instead if it's installed
+    resource = None
+
+
+# Set up
+
+# whether phases are being recorded
+enabled = False
+# the recorded phases, in the order they finished
+records = []
+
+
+# turn profiling on or off and forget anything recorded so far
+def enable(on=True):
+    global enabled
+    enabled = on
+    records.clear()
+
+
+# resident set size of this process right now in bytes, or None if it can't be measured here
+def current_rss():
+    try:
+        # the second field of statm is the number of resident pages
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+# peak resident set size of this process so far in bytes (the high-water mark), or None if it can't be measured here
+def peak_rss():
+    if resource is not None:
+        # linux reports ru_maxrss in kilobytes, macos in bytes
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+# record one phase; the caller can fill in 'rows' and 'bytes_read' on the yielded record
+@contextmanager
+def phase(name, report=None, year=None, datafile=None):
+    record = {'phase': name, 'report': report, 'year': year, 'datafile': datafile, 'rows': None, 'bytes_read': None}
+    if not enabled:
+        yield record
+        return
+    rss_start = current_rss()
+    start = time.perf_counter()
+    yield record
+    record['seconds'] = time.perf_counter() - start
+    record['rss_start_bytes'] = rss_start
+    record['rss_end_bytes'] = current_rss()
+    record['rss_growth_bytes'] = record['rss_end_bytes'] - rss_start if rss_start is not None else None
+    record['peak_rss_bytes'] = peak_rss()
+    record['pid'] = os.getpid()
+    records.append(record)
+
+
+# totals by phase name: count, seconds, rows, bytes read, the largest RSS growth of a single phase and the highest
+# peak RSS of the process seen when one finished (cumulative, so it's the high-water mark up to that phase)
+def summarize(recs=None):
+    summary = {}
+    for rec in records if recs is None else recs:
+        s = summary.setdefault(rec['phase'], {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes_read': 0, 'rss_growth_bytes': 0, 'peak_rss_bytes': 0})
+        s['count'] += 1
+        s['seconds'] += rec['seconds']
+        s['rows'] += rec['rows'] or 0
+        s['bytes_read'] += rec['bytes_read'] or 0
+        s['rss_growth_bytes'] = max(s['rss_growth_bytes'], rec.get('rss_growth_bytes') or 0)
+        s['peak_rss_bytes'] = max(s['peak_rss_bytes'], rec['peak_rss_bytes'] or 0)
+        # memory of the loaded frames before and after compaction (see scl_data.compact)
+        if 'bytes_before' in rec:
+            s['bytes_before'] = s.get('bytes_before', 0) + rec['bytes_before']
+            s['bytes_after'] = s.get('bytes_after', 0) + rec['bytes_after']
+    return summary
+
+
+# print the summary table, slowest phase first; grown MB is the most one phase added to the RSS, and the
+# process peak MB is the high-water mark so far, not the memory of the phase
+def print_summary():
+    summary = summarize()
+    print ("%-16s %6s %10s %12s %12s %12s %16s" % ('phase', 'count', 'seconds', 'rows', 'MB read', 'grown MB', 'process peak MB'))
+    for name, s in sorted(summary.items(), key=lambda item: -item[1]['seconds']):
+        print ("%-16s %6d %10.3f %12d %12.1f %12.1f %16.1f" % (name, s['count'], s['seconds'], s['rows'], s['bytes_read'] / 1e6,
+                                                            s['rss_growth_bytes'] / 1e6, s['peak_rss_bytes'] / 1e6))
+    if 'bytes_before' in summary.get('compact', {}):
+        s = summary['compact']
+        print ("loaded frames: %.1f MB as read, %.1f MB compacted (%.0f%%)" % (s['bytes_before'] / 1e6, s['bytes_after'] / 1e6, 100.0 * s['bytes_after'] / max(s['bytes_before'], 1)))
+
+
+# write the individual records and the summary to a json trace file
+def write_trace(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summarize(), 'records': records}, f, indent=1)
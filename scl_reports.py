@@ -0,0 +1,35 @@
+# scl_reports.py
+
+# Goal:  produce all the SCL website rangewide tables in one run
+# see notes in this Word doc:  SCL website rangewide table details 10-14-2022.docx
+#
+# each input geojson is read once and shared between every report that needs it (see scl_engine.py)
+# the individual report scripts can still be run on their own
+#
+# example:  python scl_reports.py --workers 8
+#           python scl_reports.py --years 2020-01-01 --reports landscape_list species_by_admin
+
+# run using Anaconda environment:  C:\Users\esanderson>conda activate scl
+
+# imports
+import scl_engine
+# importing the report scripts registers them with the engine
+import habitat_area_trends
+import landscape_area_trends
+import landscapes
+import species_landscape_by_admin
+import species_landscapes_by_biome
+import landscape_changes
+
+
+# Set up
+
+# data files organized by folder by time point are in this directory:
+scl_dir = r"C:\proj\species\tigers\TCLs v3\TCL delineation\scl_stats_09142022"
+
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+
+
+if __name__ == '__main__':
+    scl_engine.main(list(scl_engine.reports), scl_dir, years)
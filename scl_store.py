@@ -0,0 +1,231 @@
+# scl_store.py
+
+# Goal:  consolidate a downloaded scl_stats release into one columnar dataset that every report can query
+#
+# the store is a hive-partitioned parquet dataset:
+#     <store>/attributes/year=2020-01-01/lstype=scl_species/part-0.parquet
+# where lstype is the datafile name without .geojson (scl_states, scl_species, scl_species_fragment, ...)
+# area columns (*_area) are stored as float64, or float32 with --float32
+# geometry is optional and kept in its own column group, as geojson text with the same partitions:
+#     <store>/geometry/year=2020-01-01/lstype=scl_species/part-0.parquet
+# both groups carry a 'feature' column (position of the feature in the source geojson) to join them back together
+#
+# query() reads across years and landscape types with partition pruning, predicate pushdown (e.g. on lsid) and
+# column projection, so "eff_pot_hab_area for lsid X over time" is one dataset scan instead of 20 geojson opens
+# the engine reads the store instead of the geojsons with --store (see scl_engine.py)
+#
+# ingest is incremental: the content hash of every source geojson is kept in <store>/ingest.json, with the options
+# (--float32) its partition was written with, and partitions whose source and options haven't changed are left alone
+#
+# ingest also builds the per-lsid aggregate index of every partition (see scl_index.py), which lookup() reads
+#
+# example:  python scl_store.py "C:\proj\...\scl_stats_09142022" --store D:\scl_store --workers 8
+#           python scl_reports.py --scl-dir D:\scl_reports_out --store D:\scl_store
+
+# imports
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import ijson
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pandas as pd
+import scl_data
+import scl_index
+import scl_names
+
+
+# Set up
+
+# column groups inside the store
+attributes_subdir = "attributes"
+geometry_subdir = "geometry"
+# source hashes and ingest options of everything ingested so far
+ingest_file = "ingest.json"
+# partition keys, both stored as strings
+partitioning = ds.partitioning(pa.schema([('year', pa.string()), ('lstype', pa.string())]), flavor='hive')
+
+
+# landscape type (partition value) for a datafile, or a landscape type as the reports and the names registry give it
+# scl_species_fragment.geojson, scl_species_fragment and species fragment are all scl_species_fragment
+def lstype_of(datafile):
+    return 'scl_' + scl_names.normalize_lstypes([datafile])[0].replace(' ', '_')
+
+
+# path of one partition file within a column group
+def part_path(store_dir, group, year, datafile):
+    return os.path.join(store_dir, group, 'year=' + year, 'lstype=' + lstype_of(datafile), 'part-0.parquet')
+
+
+# what was recorded at ingest, as a dictionary of 'year/datafile' -> {'source': hash, 'float32': bool}
+# stores ingested before the options were recorded have the bare hash instead
+def read_ingest(store_dir):
+    return scl_data.read_json(os.path.join(store_dir, ingest_file), {})
+
+
+# record what's been ingested (see scl_data.write_json)
+def write_ingest(store_dir, ingested):
+    scl_data.write_json(os.path.join(store_dir, ingest_file), ingested)
+
+
+# the timepoints and datafiles in the store, in the same form as scl_data.discover
+def discover(store_dir):
+    found = {}
+    for key in sorted(read_ingest(store_dir), reverse=True):
+        year, datafile = key.split('/')
+        found.setdefault(year, []).append(datafile)
+    return {year: sorted(datafiles) for year, datafiles in found.items()}
+
+
+# source hashes of the ingested (year, datafile) items, in the same form as the engine's digests
+def digests(store_dir):
+    return {tuple(key.split('/')): source_of(entry) for key, entry in read_ingest(store_dir).items()}
+
+
+# source hash of an ingest.json entry, marked when the partition holds float32 areas so results the engine stored
+# from it aren't mistaken for ones from a float64 partition of the same source
+def source_of(entry):
+    if not isinstance(entry, dict):
+        return entry
+    return entry['source'] + ('/float32' if entry['float32'] else '')
+
+
+# stream the geometry of each feature in a geojson as geojson text, in feature order
+def read_geometries(path):
+    with open(path, 'rb') as f:
+        geometries = [json.dumps(g) for g in ijson.items(f, 'features.item.geometry', use_float=True)]
+    return pd.DataFrame({'feature': range(len(geometries)), 'geometry': geometries})
+
+
+# cast the area columns and add the feature position
+def prepare(df, float32=False):
+    df = df.copy()
+    for col in df.columns:
+        if col.endswith('_area'):
+            df[col] = df[col].astype('float32' if float32 else 'float64')
+    df.insert(0, 'feature', range(len(df)))
+    return df
+
+
+# turn scl_dir into a store at store_dir, re-writing only the partitions whose source geojson is new or has changed
+# years = None ingests every timepoint found in scl_dir
+def ingest(scl_dir, store_dir, years=None, float32=False, geometry=False, workers=1):
+    found = scl_data.discover(scl_dir)
+    items = [(year, datafile) for year in (years or list(found)) for datafile in found.get(year, [])]
+
+    manifest = scl_data.read_manifest(scl_dir)
+    hashes = {item: scl_data.file_digest(scl_dir, item[0], item[1], manifest) for item in items}
+    ingested = read_ingest(store_dir)
+    indexed = scl_index.read_index(store_dir)
+    # a partition written with other options (or before they were recorded) is written again
+    changed = [item for item in items
+               if ingested.get(item[0] + '/' + item[1]) != {'source': hashes[item], 'float32': float32}
+               or (geometry and not os.path.exists(part_path(store_dir, geometry_subdir, *item)))]
+    # partitions ingested before the index existed, or whose index is out of date, are indexed too
+    todo = [item for item in items
+            if item in changed or indexed.get(item[0] + '/' + item[1], {}).get('source') != hashes[item]]
+
+    # each partition is written and indexed as soon as it's loaded, so only the ones in flight are held in memory
+    for (year, datafile), df in scl_data.iter_many(scl_dir, todo, workers=workers, digests=hashes):
+        key = year + '/' + datafile
+        if (year, datafile) in changed:
+            print ("Ingesting", year, datafile)
+            scl_data.write_cache(prepare(df, float32), part_path(store_dir, attributes_subdir, year, datafile))
+            if geometry:
+                scl_data.write_cache(read_geometries(os.path.join(scl_dir, year, datafile)), part_path(store_dir, geometry_subdir, year, datafile))
+            ingested[key] = {'source': hashes[(year, datafile)], 'float32': float32}
+        print ("Indexing", year, datafile)
+        indexed[key] = {'source': hashes[(year, datafile)], 'tables': scl_index.write(store_dir, year, datafile, df)}
+
+    scl_data.write_manifest(scl_dir, manifest)
+    write_ingest(store_dir, ingested)
+    scl_index.write_index(store_dir, indexed)
+
+
+# open a column group of the store as one dataset
+# the partitions don't all have the same columns (e.g. indigenous_range_area is only in scl_states), so the
+# schema is the union of them all; columns missing from a partition come back as nulls
+def dataset(store_dir, group=attributes_subdir):
+    root = os.path.join(store_dir, group)
+    files = ds.dataset(root, format='parquet', partitioning=partitioning)
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in files.get_fragments()] + [partitioning.schema])
+    return ds.dataset(root, schema=schema, format='parquet', partitioning=partitioning)
+
+
+# query the store across years and landscape types
+# years and lstypes prune partitions (lstypes in any of the spellings lstype_of takes), lsids is pushed down to the parquet row groups, and only the given columns are read
+# where is an optional extra pyarrow expression, e.g. ds.field('eff_pot_hab_area') > 0
+def query(store_dir, columns=None, years=None, lstypes=None, lsids=None, where=None, group=attributes_subdir):
+    conditions = []
+    if years is not None:
+        conditions.append(ds.field('year').isin(list(years)))
+    if lstypes is not None:
+        conditions.append(ds.field('lstype').isin([lstype_of(t) for t in lstypes]))
+    if lsids is not None:
+        conditions.append(ds.field('lsid').isin(list(lsids)))
+    if where is not None:
+        conditions.append(where)
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return dataset(store_dir, group).to_table(columns=columns, filter=condition).to_pandas()
+
+
+# look landscapes up in the aggregate index (see scl_index.py) across years and landscape types
+# table is 'landscapes' (areas by lsid), 'countries' (by lsid and country) or 'biomes' (by lsid and biome)
+# e.g. lookup(store, 'landscapes', lsids=[lsid], columns=['year','lstype','eff_pot_hab_area']) is one landscape over time
+def lookup(store_dir, table, lsids=None, years=None, lstypes=None, columns=None):
+    return query(store_dir, columns, years, lstypes, lsids, group=os.path.join(scl_index.index_subdir, table))
+
+
+# load the given columns of one (year, datafile) partition, or their sums by keys in batches when keys is not None,
+# compacted like the frames scl_data loads (see scl_data.compact)
+def load_one(store_dir, year, datafile, columns, keys=None, batch_size=scl_data.default_batch_size, float32=False):
+    path = part_path(store_dir, attributes_subdir, year, datafile)
+    if keys is None:
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        values = [col for col in columns if col not in keys]
+        df = scl_data.aggregate_batches(scl_data.iter_parquet_batches(path, keys + values, batch_size), keys, values)
+    return scl_data.compact_profiled(df, float32, year, datafile)
+
+
+def load_args(args):
+    return load_one(*args)
+
+
+# load the given columns for a list of (year, datafile) items straight from their partitions, in the same form as
+# scl_data.iter_many (including summing by keys in batches for the datafiles in aggregate, and reading the next
+# prefetch_depth partitions in background threads)
+def iter_many(store_dir, items, columns=None, aggregate=None, batch_size=scl_data.default_batch_size, prefetch_depth=scl_data.default_prefetch,
+              float32=False):
+    items = [tuple(item) for item in items]
+    aggregate = aggregate or {}
+    args = [(store_dir, year, datafile, columns[datafile] if isinstance(columns, dict) else columns, aggregate.get(datafile), batch_size, float32)
+            for year, datafile in items]
+    if prefetch_depth > 0 and len(args) > 1:
+        with ThreadPoolExecutor(max_workers=prefetch_depth) as threads:
+            yield from zip(items, scl_data.prefetch(threads, load_args, args, prefetch_depth))
+    else:
+        for item, a in zip(items, args):
+            yield item, load_args(a)
+
+
+# load the given columns for a list of (year, datafile) items all at once, in the same form as scl_data.load_many
+def load_many(store_dir, items, columns=None, aggregate=None, batch_size=scl_data.default_batch_size):
+    return dict(iter_many(store_dir, items, columns, aggregate, batch_size, prefetch_depth=0))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scl_dir', help='folder holding the SCL outputs organized by timepoint')
+    parser.add_argument('--store', default=None, help='folder for the store (default: scl_store inside scl_dir)')
+    parser.add_argument('--years', nargs='+', default=None, help='timepoints to ingest (default: every timepoint found in scl_dir)')
+    parser.add_argument('--float32', action='store_true', help='store the area columns as float32 instead of float64')
+    parser.add_argument('--geometry', action='store_true', help='also store the geometry column group')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes used to load the geojson files (1 = serial)')
+    args = parser.parse_args()
+
+    ingest(args.scl_dir, args.store or os.path.join(args.scl_dir, 'scl_store'), args.years, args.float32, args.geometry, args.workers)
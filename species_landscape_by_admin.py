@@ -15,10 +15,11 @@
 
 # imports
 import os
-import geopandas as gpd
 import pandas as pd
 import numpy as np
-import csv
+import scl_engine
+import scl_plan
+import scl_output
 
 # Set up
 
@@ -30,69 +31,63 @@ pivot_subdir = "pivot_tables\habitat_areas"
 datafile = "scl_species.geojson"
 # csv output file
 csv_file = 'species_landscapes_by_admin.csv'
+# sheet name in xlsx output
+sheet_name = 'Species landscape by admin'
 
-# the years to analyze are:
-#years = ['2020-01-01','2019-01-01','2018-01-01','2017-01-01','2016-01-01','2015-01-01','2014-01-01','2013-01-01','2012-01-01','2011-01-01','2010-01-01','2009-01-01','2008-01-01','2007-01-01','2006-01-01','2005-01-01','2004-01-01','2003-01-01','2002-01-01','2001-01-01']
-# a single year for testing purposes
-years = ['2020-01-01']
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+# a single year for testing purposes:  --years 2020-01-01
 # habitat types to analyze are:
 types = ['eff_pot_hab_area']
 
-# make an empty dictionary to hold areas by year
-#dict_pivots = {}
+# fraction of each landscape's area in each country: sum the area by lsid and country, take each country's
+# share of the landscape total and spread the countries out into columns
+plans = {'ls_frac': scl_plan.Plan(datafile).group_sum(['lsid','country'], types)
+                                           .share('ls_frac', 'eff_pot_hab_area', within=['lsid'])
+                                           .pivot('country', 'ls_frac')}
 
-# loop over years
-for year in years:
 
-    # read file
-    df = gpd.read_file(os.path.join(scl_dir, year, datafile))
+# loop over years and fill out the fraction of each landscape in each country, returning one table for all years
+def build(dfs, years):
 
-    # for each habitat type, create pivot table using pandas summing areas by type
-    pivot_areas_df = pd.pivot_table(df, 
-        values = types,       
-        index = ['lsid','country'],
-        aggfunc = 'sum')
+    # make an empty list to hold the tables by year
+    admin_dfs = []
 
-    # sum up the areas by lsid using groupby then rename column to avoid confusion
-    ls_sum_df = pivot_areas_df.groupby(level='lsid').sum()
-    ls_sum_df.rename(columns={'eff_pot_hab_area': 'sum_area'}, inplace = True)
+    for year in years:
 
-    # reset indexes to get rid of multi-index before joining using merge
-    ls_areas_df = pd.merge(pivot_areas_df.reset_index(), ls_sum_df.reset_index(), how = 'inner', on = 'lsid')
+        # one row per lsid, one column per country, from the plan
+        ls_admin_df = dfs[(year, 'ls_frac')]
 
-    # calculate fraction of each landscape in each country
-    ls_areas_df['ls_frac'] = ls_areas_df['eff_pot_hab_area'] / ls_areas_df['sum_area']
+        # add a few columns to fill out table before output
+        ls_admin_df['date'] = year
+        ls_admin_df['lsid'] = ls_admin_df.index                   
+        ls_admin_df['lstype'] = "species"
+        # placeholder, filled in from the landscape names registry by the engine (see scl_names.py)
+        ls_admin_df['name'] = "tbd"
 
-    # drop the areas
-    ls_areas_df.drop(columns=['eff_pot_hab_area','sum_area'], axis=1, inplace=True)
+        admin_dfs.append(ls_admin_df)
 
-    # repivot to get the final arrangement for the table
-    ls_admin_df = pd.pivot_table(ls_areas_df, 
-        values = ['ls_frac'],       
-        index = ['lsid'],
-        columns = ['country'],
-        aggfunc = 'sum',
-        fill_value = 0)   
+    if not admin_dfs:
+        return pd.DataFrame(columns=['date','lsid','lstype','name'])
 
-    #pivot above results in mutli-index for columns, so drop a level
-    ls_admin_df = ls_admin_df.droplevel(0, axis = 1)
+    # stack the years; the countries can differ from year to year, so take all of them in alphabetical order
+    # and give a landscape zero in any country it didn't have that year
+    ls_admin_df = pd.concat(admin_dfs)
+    countries = sorted(set().union(*(df.columns for df in admin_dfs)) - {'date','lsid','lstype','name'})
+    ls_admin_df[countries] = ls_admin_df[countries].fillna(0)
 
-    # get list of countries, which are the column heads holding the ls_frac data
-    countries = list(ls_admin_df.columns)
+    return ls_admin_df[['date','lsid','lstype','name'] + countries]
 
-    # add a few columns to fill out table before output
-    ls_admin_df['date'] = year
-    ls_admin_df['lsid'] = ls_admin_df.index                   
-    ls_admin_df['lstype'] = "species"
-    ls_admin_df['name'] = "tbd"
 
-    # output to csv with fields in desired order
-    # write header
+# output with fields in desired order, in the configured formats (see scl_output.py)
+def write(ls_admin_df, scl_dir, years):
+    countries = list(ls_admin_df.columns[4:])
     fieldnames = ['Analysis date','Lsid','Landscape type','Name'] + countries
-    with open(os.path.join(scl_dir, csv_file), 'w', newline='', encoding = 'utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(fieldnames)
+    scl_output.write_table(ls_admin_df, scl_dir, csv_file, fieldnames, sheet_name)
 
-    # output to csv from dataframe
-    fields = ['date','lsid','lstype','name'] + countries
-    ls_admin_df.to_csv(os.path.join(scl_dir, csv_file), columns = fields, header=False, index = False, mode='a')
\ No newline at end of file
+
+scl_engine.register('species_by_admin', None, build, write, keys=['lsid','country'], plans=plans)
+
+
+if __name__ == '__main__':
+    scl_engine.main(['species_by_admin'], scl_dir, years)
@@ -15,11 +15,11 @@
 
 # imports
 import os
-import geopandas as gpd
 import pandas as pd
 import numpy as np
-import csv
-import json
+import scl_engine
+import scl_plan
+import scl_output
 
 # Set up
 
@@ -31,118 +31,71 @@ pivot_subdir = "pivot_tables\habitat_areas"
 datafile = "scl_species.geojson"
 # csv output file
 csv_file = 'species_landscapes_by_biome.csv'
+# sheet name in xlsx output
+sheet_name = 'Species landscape by biome'
 
-# the years to analyze are:
-#years = ['2020-01-01','2019-01-01','2018-01-01','2017-01-01','2016-01-01','2015-01-01','2014-01-01','2013-01-01','2012-01-01','2011-01-01','2010-01-01','2009-01-01','2008-01-01','2007-01-01','2006-01-01','2005-01-01','2004-01-01','2003-01-01','2002-01-01','2001-01-01']
-# a single year for testing purposes
-years = ['2020-01-01']
+# the years to analyze are every timepoint subfolder found in scl_dir (see scl_data.discover)
+years = None
+# a single year for testing purposes:  --years 2020-01-01
 # habitat types to analyze are:
 types = ['eff_pot_hab_area']
+# expected order for output
+# note this will drop any biome = NaN, which creates some small rounding issues
+biome_order = ['Tropical & Subtropical Moist Broadleaf Forests', 'Tropical & Subtropical Dry Broadleaf Forests', 'Tropical & Subtropical Grasslands, Savannas & Shrublands', 'Tropical & Subtropical Coniferous Forests', 'Mangroves', 'Temperate Broadleaf & Mixed Forests', 'Temperate Conifer Forests', 'Flooded Grasslands & Savannas', 'Montane Grasslands & Shrublands', 'Boreal Forests/Taiga', 'Deserts',  'Xeric Shrublands']
 
-# make an empty dictionary to hold areas by year
-#dict_pivots = {}
+# the landscape areas by lsid, and the ecoregions exploded into one row per (polygon, ecoregion) and summed
+# by lsid and biome, with the biomes spread out into columns
+# note biome_name = NaN is dropped by the group_sum, which creates some small rounding issues
+plans = {'areas': scl_plan.Plan(datafile).group_sum(['lsid'], types),
+         'biomes': scl_plan.Plan(datafile).explode_json('ecoregions', ['biome_name','eff_pot_hab_area'], carry=['lsid'])
+                                          .group_sum(['lsid','biome_name'], ['eff_pot_hab_area'])
+                                          .pivot('biome_name', 'eff_pot_hab_area')}
 
-# loop over years
-for year in years:
 
-    # read file
-    df = gpd.read_file(os.path.join(scl_dir, year, datafile))
+# loop over years and calculate the fraction of each landscape in each biome, returning one table for all years
+def build(dfs, years):
 
-    # pull out ecoregions json where the biome info is
-    ecoregions_df = df[['id','ecoregions']]
+    # make an empty list to hold the tables by year
+    biome_dfs = []
 
-    # set index to match id (note this is the unique id of the polygon from GEE, not lsid)
-    ecoregions_df.set_index('id', inplace=True, drop=True)
-    #ecoregions_df.set_index('month')
+    for year in years:
 
-    # convert df to dictionary, indexed by lsid
-    # note this requires transposition and selection of the right keyword for *.to_dict
-    # see this helpful explainer: https://stackoverflow.com/questions/26716616/convert-a-pandas-dataframe-to-a-dictionary
-    # ecoregion_list above is 1 item list containing a list of json strings
-    ecoregions_dict = ecoregions_df.T.to_dict('list')
+        # landscapes without any ecoregions get zero in every biome
+        ls_area = dfs[(year, 'areas')]['eff_pot_hab_area']
+        ls_biome_df = dfs[(year, 'biomes')].reindex(ls_area.index, fill_value=0)
 
-    # create an empty dictionary to hold biome sums, eventually this will be key'd by id, biome_name
-    biome_sum = {}
+        # calculate fraction of landscape area in each biome
+        ls_biome_df = ls_biome_df.div(ls_area, axis=0)
 
-    # an id for testing
-    #an_id = '00000000000000000001_00000000000000000010'
+        # add a few columns to fill out table before output
+        ls_biome_df['date'] = year
+        ls_biome_df['lsid'] = ls_biome_df.index                   
+        ls_biome_df['lstype'] = "species"
+        # placeholder, filled in from the landscape names registry by the engine (see scl_names.py)
+        ls_biome_df['name'] = "tbd"
 
-    # loop over each id
-    for an_id in ecoregions_dict.keys():
+        # if a biome doesn't exist, then make it and fill with zero
+        for biome in biome_order:
+            if biome not in ls_biome_df.columns:
+                ls_biome_df[biome] = 0
 
-        # create an empty dictionary entry for each id
-        biome_sum[an_id] = {}
+        # keep just the output fields so years with different biomes line up
+        biome_dfs.append(ls_biome_df[['date','lsid','lstype','name'] + biome_order])
 
-        # loop over data_strings for each id
-        for data_str in ecoregions_dict[an_id]:
+    # stack the years into a single table
+    if not biome_dfs:
+        return pd.DataFrame(columns=['date','lsid','lstype','name'] + biome_order)
+    return pd.concat(biome_dfs)
 
-            # convert to from json (is this necessary? is there a better way?)... results in list of dictionaries
-            data_list = json.loads(data_str)
 
-            # loop over the list to access the dictionaries with the biome data
-            for data_dict in data_list:
-
-                # set value to zero if first time seeing this biome
-                if data_dict['biome_name'] not in biome_sum[an_id]:
-                    biome_sum[an_id][data_dict['biome_name']] = 0
-
-                # add eff_pot_hab_area for this id sum of biome area
-                biome_sum[an_id][data_dict['biome_name']] = biome_sum[an_id][data_dict['biome_name']] + data_dict['eff_pot_hab_area']
-                #print(an_id, data_dict['biome_name'], biome_sum[an_id][data_dict['biome_name']])
-
-    # convert biome_sum back to df
-    # transpose so the index is id and the columsn are the sums by biome
-    biome_df = pd.DataFrame.from_dict(biome_sum).T
-
-    # fill NaN values with 0
-    biome_df = biome_df.fillna(0)
-
-    # get list of biomes as a list
-    biomes = list(biome_df.columns)
-    
-    # set index name before merging, then reset to create column before merge
-    biome_df.index.name = 'id'
-    biome_df.reset_index()
-
-    # get just id and eff_pot_hab_area from the full df
-    df1 = df[['id','lsid','eff_pot_hab_area']]
-
-    # merge biome data with the data extract above
-    biome_areas_df = pd.merge(df1, biome_df, how = 'inner', on = 'id')
-
-    # use pivot to calculate sum for each lsid
-    values_list = ['eff_pot_hab_area'] + biomes
-    ls_biome_df = pd.pivot_table(biome_areas_df, 
-        values = values_list,    
-        index = ['lsid'],
-        aggfunc = 'sum')
-
-    # calculate fraction of landscape area in each biome
-    for biome in biomes:
-        ls_biome_df[biome] = ls_biome_df[biome] / ls_biome_df['eff_pot_hab_area']  
-
-    # add a few columns to fill out table before output
-    ls_biome_df['date'] = year
-    ls_biome_df['lsid'] = ls_biome_df.index                   
-    ls_biome_df['lstype'] = "species"
-    ls_biome_df['name'] = "tbd"
+# output with fields in desired order, in the configured formats (see scl_output.py)
+def write(ls_biome_df, scl_dir, years):
+    fieldnames = ['Analysis date','Lsid','Landscape type','Name'] + biome_order
+    scl_output.write_table(ls_biome_df, scl_dir, csv_file, fieldnames, sheet_name)
 
-    # expected order for output
-    # note this will drop any biome = NaN, which creates some small rounding issues
-    biome_order = ['Tropical & Subtropical Moist Broadleaf Forests', 'Tropical & Subtropical Dry Broadleaf Forests', 'Tropical & Subtropical Grasslands, Savannas & Shrublands', 'Tropical & Subtropical Coniferous Forests', 'Mangroves', 'Temperate Broadleaf & Mixed Forests', 'Temperate Conifer Forests', 'Flooded Grasslands & Savannas', 'Montane Grasslands & Shrublands', 'Boreal Forests/Taiga', 'Deserts',  'Xeric Shrublands']
 
-    # if a biome doesn't exist, then make it and fill with zero
-    for biome in biome_order:
-        if biome not in ls_biome_df.columns:
-            ls_biome_df[biome] = 0
+scl_engine.register('species_by_biome', None, build, write, plans=plans)
 
-    # output to csv with fields in desired order
-    # write header
-    fieldnames = ['Analysis date','Lsid','Landscape type','Name'] + biome_order
-    with open(os.path.join(scl_dir, csv_file), 'w', newline='', encoding = 'utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(fieldnames)
 
-    # output to csv from dataframe
-    fields = ['date','lsid','lstype','name'] + biome_order
-    ls_biome_df.to_csv(os.path.join(scl_dir, csv_file), columns = fields, header=False, index = False, mode='a')
\ No newline at end of file
+if __name__ == '__main__':
+    scl_engine.main(['species_by_biome'], scl_dir, years)